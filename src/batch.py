@@ -0,0 +1,163 @@
+import os
+import glob
+import time
+import argparse
+import logging
+import traceback
+import multiprocessing as mp
+
+# Get the logger
+logger = logging.getLogger(__name__)
+
+# Load the internal modules
+from utils.misc import load_config
+from utils.work_queue import WorkQueue
+
+
+def get_num_workers(mem_per_job_gb):
+    """
+    Size the worker pool to the available cores and memory.
+
+    Parameters:
+    -----------
+        mem_per_job_gb : float
+            Expected peak host memory of a single exam in GB.
+
+    Returns:
+    --------
+        num_workers : int
+            Number of exams that can safely run side by side.
+    """
+    num_cores = len(os.sched_getaffinity(0))
+    total_mem_gb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3
+    num_workers = max(1, min(num_cores, int(total_mem_gb // mem_per_job_gb)))
+    logger.info(f"{num_cores} cores and {total_mem_gb:.1f} GB memory: using {num_workers} workers.")
+
+    return num_workers
+
+
+def worker(worker_id, queue_dir, config_path, max_retries, gpu_ids):
+    # Pin the worker to one GPU before sigpy/cupy get imported
+    if gpu_ids:
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_ids[worker_id % len(gpu_ids)])
+
+    # Importing main configures the log file of this worker
+    from main import main
+
+    queue = WorkQueue(queue_dir)
+    while True:
+        job = queue.claim(max_retries=max_retries)
+        if job is None:
+            break
+
+        logger.info(f"Worker {worker_id} running {job['raw_path']} (attempt {job['attempts']}).")
+        start_time = time.time()
+        try:
+            main(job["raw_path"], config_path)
+        except Exception:
+            logger.error(f"Worker {worker_id} failed on {job['raw_path']}.")
+            queue.fail(job, time.time() - start_time, traceback.format_exc())
+        else:
+            queue.complete(job, time.time() - start_time)
+
+
+def run_batch(raw_paths, config_path, queue_dir, num_workers=None, max_retries=2, mem_per_job_gb=64.0):
+    """
+    Reconstruct many exams with a pool of worker processes.
+
+    Parameters:
+    -----------
+        raw_paths : list
+            Exam directories or glob patterns.
+
+        config_path : str
+            Path to the YAML configuration file.
+
+        queue_dir : str
+            Directory of the file-backed work queue.
+
+        num_workers : int
+            Number of worker processes. If None, it is sized to the cores and memory.
+            With GPUs it is capped at `device.jobs_per_gpu` workers per GPU.
+
+        max_retries : int
+            Number of times a failed exam is retried.
+
+        mem_per_job_gb : float
+            Expected peak host memory of a single exam in GB.
+
+    Returns:
+    --------
+        summary_path : str
+            Path of the per-exam summary table.
+    """
+    start_time = time.time()
+
+    queue = WorkQueue(queue_dir)
+    for pattern in raw_paths:
+        for raw_path in sorted(glob.glob(pattern)):
+            if os.path.isdir(raw_path):
+                queue.add(raw_path)
+
+    if num_workers is None:
+        num_workers = get_num_workers(mem_per_job_gb)
+
+    # At most `jobs_per_gpu` workers per GPU, assigned round-robin over the visible GPUs
+    gpu_ids = []
+    device_config = load_config(config_path)["device"]
+    if device_config["gpu"]:
+        gpu_ids = os.environ.get("CUDA_VISIBLE_DEVICES", "0").split(",")
+        max_workers = len(gpu_ids) * device_config.get("jobs_per_gpu", 1)
+        if num_workers > max_workers:
+            logger.info(f"Limiting {num_workers} workers to {max_workers} for {len(gpu_ids)} GPUs.")
+            num_workers = max_workers
+
+    # Spawn rather than fork, CUDA state cannot be shared with child processes
+    ctx = mp.get_context("spawn")
+
+    def start_worker(worker_id):
+        process = ctx.Process(target=worker, args=(worker_id, queue_dir, config_path, max_retries, gpu_ids))
+        process.start()
+        return process
+
+    workers = {worker_id: start_worker(worker_id) for worker_id in range(num_workers)}
+    while workers:
+        for worker_id, process in list(workers.items()):
+            process.join(timeout=5)
+            if process.exitcode is None:
+                continue
+
+            del workers[worker_id]
+            # A worker killed mid-exam (e.g. by the OOM killer) is replaced while work remains
+            if process.exitcode != 0:
+                logger.warning(f"Worker {worker_id} exited with code {process.exitcode}.")
+                queue.reclaim_stale()
+                if queue.has_work(max_retries=max_retries):
+                    workers[worker_id] = start_worker(worker_id)
+
+    summary_path = queue.write_summary()
+
+    stop_time = time.time()
+    logger.info(f"Batch finished! Took: {(stop_time - start_time)/3600:.2f} hours.")
+
+    return summary_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Reconstruct many exams in parallel using a local work queue."
+        )
+    parser.add_argument("-i", "--raw_paths", type=str, nargs="+", help="Exam directories or glob patterns.")
+    parser.add_argument("--config_path", type=str, help="Path to the YAML configuration file.")
+    parser.add_argument("--queue_dir", type=str, default="batch_queue", help="Directory of the work queue.")
+    parser.add_argument("--num_workers", type=int, default=None, help="Number of worker processes.")
+    parser.add_argument("--max_retries", type=int, default=2, help="Number of retries of a failed exam.")
+    parser.add_argument("--mem_per_job_gb", type=float, default=64.0, help="Expected peak memory of one exam in GB.")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    run_batch(args.raw_paths, args.config_path, args.queue_dir,
+              num_workers=args.num_workers,
+              max_retries=args.max_retries,
+              mem_per_job_gb=args.mem_per_job_gb)
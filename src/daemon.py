@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import argparse
+import logging
+import threading
+import traceback
+from collections import OrderedDict
+
+# Get the logger
+logger = logging.getLogger(__name__)
+
+# Load the internal modules, the client only needs the queue
+from utils.work_queue import WorkQueue, DONE, FAILED
+
+# Name of the file the daemon refreshes while it is alive, and how often
+HEARTBEAT_FILE = "daemon.status"
+HEARTBEAT_INTERVAL = 5.0
+
+
+class Heartbeat:
+    """
+    Refreshes the status file of the daemon from a background thread, so
+    that it stays fresh while a long job runs. The file also records the
+    job being run and when it started.
+    """
+
+    def __init__(self, path, interval=HEARTBEAT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.job_id = None
+        self.started = None
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+
+
+    def __write(self):
+        with self.__lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"pid": os.getpid(), "time": time.time(), "job": self.job_id, "started": self.started}, f)
+            os.replace(tmp_path, self.path)
+
+
+    def __run(self):
+        while not self.__stop.wait(self.interval):
+            self.__write()
+
+
+    def start(self):
+        self.__write()
+        self.__thread.start()
+
+
+    def set_job(self, job_id):
+        """Record the job being run, None when idle."""
+        self.job_id = job_id
+        self.started = None if job_id is None else time.time()
+        self.__write()
+
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread.is_alive():
+            self.__thread.join()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class DataCache:
+    """
+    Keeps the loaded arrays (k-space, trajectory, DCF, ...) of the most
+    recently used encodes in memory. Entries are keyed by the data
+    fingerprint, so re-converted data is loaded again.
+    """
+
+    def __init__(self, max_entries=2):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+
+    def load(self, data_dir):
+        from utils.cache import fingerprint_files
+        from utils.dataloader import load_npy_files
+
+        key = (os.path.abspath(data_dir), fingerprint_files(data_dir))
+        if key in self.entries:
+            logger.info(f"Using the cached arrays of {data_dir}.")
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        data = load_npy_files(data_dir)
+        if self.max_entries > 0:
+            self.entries[key] = data
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return data
+
+
+def serve(spool_dir, max_cached_encodes=2, poll_interval=1.0):
+    """
+    Run the reconstruction daemon.
+
+    The heavy modules are imported once and the loaded encodes are kept
+    in memory between jobs, so a job only pays for the reconstruction.
+    Jobs are picked up from the spool directory, see `submit`. The spool
+    directory must not be shared with a `batch.py` queue: batch jobs use
+    the configuration of their workers and are failed if claimed here.
+
+    Parameters:
+    -----------
+        spool_dir : str
+            Directory of the job queue.
+
+        max_cached_encodes : int
+            Number of encodes whose arrays are kept in memory.
+
+        poll_interval : float
+            Seconds between two checks of the spool directory.
+    """
+    # Importing main configures the log file and loads sigpy, nibabel, ...
+    from main import main
+    # Warm up the optional modules too
+    import h5py
+    import skimage
+    from utils.convert_h5_to_npy import convert_ute
+
+    queue = WorkQueue(spool_dir)
+    data_cache = DataCache(max_entries=max_cached_encodes)
+    heartbeat = Heartbeat(os.path.join(spool_dir, HEARTBEAT_FILE))
+    heartbeat.start()
+    logger.info(f"Reconstruction daemon serving {spool_dir} (pid {os.getpid()}).")
+
+    try:
+        while True:
+            job = queue.claim(max_retries=0)
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+
+            # Only jobs added by `submit` name their configuration
+            if "config_path" not in job:
+                logger.error(f"Job {job['id']} has no config_path, it was not submitted to the daemon.")
+                queue.fail(job, 0.0, "Job has no config_path, submit it with `daemon.py submit`.")
+                continue
+
+            logger.info(f"Running job {job['id']} on {job['raw_path']}.")
+            heartbeat.set_job(job["id"])
+            start_time = time.time()
+            try:
+                main(job["raw_path"], job["config_path"], loader=data_cache.load)
+            except Exception:
+                logger.error(f"Job {job['id']} failed.")
+                queue.fail(job, time.time() - start_time, traceback.format_exc())
+            else:
+                queue.complete(job, time.time() - start_time)
+            heartbeat.set_job(None)
+
+    except KeyboardInterrupt:
+        logger.info(f"Reconstruction daemon stopped.")
+
+    finally:
+        heartbeat.stop()
+
+
+def submit(spool_dir, raw_path, config_path, wait=False, poll_interval=1.0):
+    """
+    Submit a job to the daemon and optionally wait for it to finish.
+
+    Returns:
+    --------
+        job : dict
+            The job state when it was submitted or, with `wait`, when it finished.
+    """
+    if config_path is None or not os.path.isfile(config_path):
+        raise ValueError(f"A daemon job needs an existing configuration file, got {config_path}.")
+
+    queue = WorkQueue(spool_dir)
+    job_id = queue.add(raw_path, requeue=True, config_path=os.path.abspath(config_path))
+    print(f"Submitted {job_id}.")
+
+    job = queue.get(job_id)
+    while wait and job["status"] not in (DONE, FAILED):
+        time.sleep(poll_interval)
+        job = queue.get(job_id)
+
+    return job
+
+
+def status(spool_dir, max_heartbeat_age=30.0):
+    """Print whether the daemon is alive and the state of every job."""
+    queue = WorkQueue(spool_dir)
+
+    heartbeat_path = os.path.join(spool_dir, HEARTBEAT_FILE)
+    if os.path.exists(heartbeat_path):
+        with open(heartbeat_path, "r") as f:
+            heartbeat = json.load(f)
+        age = time.time() - heartbeat["time"]
+        if age >= max_heartbeat_age:
+            state = f"not responding for {age:.0f} s"
+        elif heartbeat.get("job") is not None:
+            state = f"running job {heartbeat['job']} for {time.time() - heartbeat['started']:.0f} s"
+        else:
+            state = "idle"
+        print(f"Daemon (pid {heartbeat['pid']}): {state}.")
+    else:
+        print(f"Daemon: not running.")
+
+    for job in queue.jobs():
+        elapsed = "" if job["elapsed"] is None else f"{job['elapsed']:.1f} s"
+        print(f"{job['id']}\t{job['status']}\t{elapsed}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Resident reconstruction service with warm caches."
+        )
+    parser.add_argument("command", choices=["serve", "submit", "status"], help="Run the daemon, submit a job or show the job states.")
+    parser.add_argument("--spool_dir", type=str, default="spool", help="Directory of the job queue.")
+    parser.add_argument("-i", "--raw_path", type=str, help="Path to the exam directory (submit).")
+    parser.add_argument("--config_path", type=str, help="Path to the YAML configuration file (submit).")
+    parser.add_argument("--wait", action="store_true", help="Wait for the submitted job to finish (submit).")
+    parser.add_argument("--max_cached_encodes", type=int, default=2, help="Number of encodes kept in memory (serve).")
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.spool_dir, max_cached_encodes=args.max_cached_encodes)
+
+    elif args.command == "submit":
+        job = submit(args.spool_dir, args.raw_path, args.config_path, wait=args.wait)
+        if args.wait:
+            print(f"{job['id']}: {job['status']} in {job['elapsed']:.1f} s.")
+            if job["status"] == FAILED:
+                print(job["error"])
+
+    else:
+        status(args.spool_dir)
@@ -19,13 +19,15 @@ logger = logging.getLogger(__name__)
 
 # Load the internal modules
 from utils.dataloader import load_npy_files
-from utils.misc import load_config, save_nifti_volume
+from utils.misc import load_config, remove_multiscale_volume, save_multiscale_volume, save_nifti_volume
 from utils.auto_fov import auto_fov
-from no_gating.no_gating import NoGating
-from hard_gating.hard_gating import HardGating
-from soft_gating.soft_gating import SoftGating
+from utils.cache import ResultCache, fingerprint_encode, fingerprint_files, make_cache_key, rewriting_output
+from utils.nufft_autotune import get_tuning_file, load_nufft_params
+from utils.planner import get_array_shapes, get_cost_model_file, get_data_shapes, load_cost_model, plan_recons
+from recon.build import build_recons
 
-def main(raw_path, config_path):
+
+def main(raw_path, config_path, loader=load_npy_files):
     start_time = time.time()
 
     # Load the global configuration parameters
@@ -45,62 +47,120 @@ def main(raw_path, config_path):
 
 
     # Convert the MRI_Raw.h5 file into npy files
+    encodes = None
     if config["preprocessing"]["convert_h5"]:
-        # Loading the convert_ute function
-        from utils.convert_h5_to_npy import convert_ute
+        # Loading the convert functions
+        from utils.convert_h5_to_npy import convert_ute, prefetch_ute
 
         # Set the path to import raw and to save the npy files
         h5_path = os.path.join(raw_path, "MRI_Raw.h5")
-
-        # Extract the required files and save as npy files
-        convert_ute(h5_path, output_dir=processed_dir)
-
-    # Check if there are multiple directories (in-case of multiple encodes)
-    encode_dirs = os.listdir(processed_dir)
-
-    # Load the npy files
-    for encode_dir in encode_dirs:
+        compact_traj = config["preprocessing"].get("compact_traj", True)
+
+        if config["preprocessing"].get("pipeline", False):
+            # Hand the encodes over in memory, saving the npy files in the background
+            output_dir = processed_dir if config["preprocessing"].get("persist_npy", True) else None
+            encodes = prefetch_ute(h5_path, output_dir=output_dir, compact_traj=compact_traj)
+        else:
+            # Extract the required files and save as npy files
+            convert_ute(h5_path, output_dir=processed_dir, compact_traj=compact_traj)
+
+    # Set up the cache of reconstruction outputs
+    cache = None
+    cache_config = config.get("cache", {})
+    if cache_config.get("enabled", False):
+        cache_dir = cache_config.get("dir") or os.path.join(recon_dir, "cache")
+        cache = ResultCache(cache_dir, max_size_gb=cache_config.get("max_size_gb", 20.0))
+
+    # Use the tuned NUFFT parameters of this trajectory type, if any
+    nufft_params = None
+    if "nufft" in config:
+        nufft_params = load_nufft_params(get_tuning_file(config, config_path), config["nufft"]["trajectory"],
+                                         config["output"]["img_shape"])
+
+    # Optionally write a chunked multiscale pyramid next to each NIfTI output
+    multiscale = config['output'].get('multiscale', False)
+
+    # Check if there are multiple directories (in-case of multiple encodes), their data is loaded when needed
+    if encodes is None:
+        encodes = ((encode_dir, None) for encode_dir in os.listdir(processed_dir))
+
+    for encode_dir, data in encodes:
         processed_file_dir = os.path.join(processed_dir, encode_dir)
-        ksp, coord, dcf, resp, tr, noise = load_npy_files(processed_file_dir)
 
         # Creating directory to save output for each encode
         out_dir = os.path.join(processed_file_dir, 'output')
         os.makedirs(out_dir, exist_ok=True)
-    
-        # Run No_Gating Reconstruction
-        if config['reconstructions']['no_gating']:
-            # Create a directory to save the files
-            save_dir = os.path.join(out_dir, "no_gating")
-            os.makedirs(save_dir, exist_ok=True)
-            
-            no_gating = NoGating(img_shape=config['output']['img_shape'], device=device)
-            output_vol = no_gating.run(ksp, coord, dcf)
-
-            save_nifti_volume(output_vol, filename="no_gating.nii.gz", save_dir=save_dir)
-        
-        # Run Hard_Gating Reconstruction
-        if config['reconstructions']['hard_gating']:
-            # Create a directory to save the files
-            save_dir = os.path.join(out_dir, "hard_gating")
-            os.makedirs(save_dir, exist_ok=True)
-
-            hard_gating = HardGating(img_shape=config['output']['img_shape'], gating_thresh=config['hard_gating']['thresh'], device=device)
-            output_vol = hard_gating.run(ksp, coord, dcf, resp)
 
-            save_nifti_volume(output_vol, filename="hard_gating.nii.gz", save_dir=save_dir)
-
-        # Run Soft-Gating Reconstruction
-        if config['reconstructions']['soft_gating']:
+        # Configure the enabled reconstructions
+        recons = build_recons(config, device, nufft_params=nufft_params)
+
+        # Check that the reconstructions fit in memory, picking chunk sizes from the array shapes
+        planner_config = config.get("planner", {})
+        if planner_config.get("enabled", False):
+            shapes = get_data_shapes(processed_file_dir) if data is None else get_array_shapes(*data[:4])
+            # In pipeline mode the next encodes are held in memory too, one buffered and one being converted
+            reserved_host_mem = 0 if data is None else 2 * sum(x.nbytes for x in data)
+            plan_recons(recons, shapes,
+                        cost_model=load_cost_model(get_cost_model_file(config, config_path)),
+                        device=device,
+                        memory_fraction=planner_config.get("memory_fraction", 0.9),
+                        allow_downscale=planner_config.get("allow_downscale", False),
+                        reserved_host_mem=reserved_host_mem)
+
+        # Find the reconstructions whose output is missing or out of date
+        fingerprint = None
+        if cache is not None:
+            fingerprint = fingerprint_files(processed_file_dir) if data is None else fingerprint_encode(*data)
+        pending = {}
+        for name, recon in recons.items():
             # Create a directory to save the files
-            save_dir = os.path.join(out_dir, "soft_gating")
+            save_dir = os.path.join(out_dir, name)
             os.makedirs(save_dir, exist_ok=True)
-
-            gating_thresh = config['soft_gating']['thresh']
-            gating_weight = config['soft_gating']['gating_weight']
-            soft_gating = SoftGating(img_shape=config['output']['img_shape'], gating_thresh=gating_thresh, gating_weight=gating_weight, device=device)
-            output_vol = soft_gating.run(ksp, coord, dcf, resp)
-
-            save_nifti_volume(output_vol, filename="soft_gating.nii.gz", save_dir=save_dir)
+            output_path = os.path.join(save_dir, f"{name}.nii.gz")
+            # The pyramid is renamed into place once complete and removed when the NIfTI is rewritten
+            # without it, so an existing store is complete and matches the NIfTI
+            pyramid_missing = multiscale and not os.path.exists(os.path.join(save_dir, f"{name}.zarr"))
+
+            key = None
+            if cache is not None:
+                key = make_cache_key(fingerprint, name, recon)
+                if cache.is_current(output_path, key) and not pyramid_missing:
+                    logger.info(f"Skipping {name} reconstruction for {encode_dir}, output is up to date.")
+                    continue
+
+            pending[name] = (recon, save_dir, key)
+
+        if not pending:
+            # Release the encode before the next one is handed over
+            data = None
+            continue
+
+        # Load the npy files
+        if data is None:
+            data = loader(processed_file_dir)
+        ksp, coord, dcf, resp, tr, noise = data
+
+        for name, (recon, save_dir, key) in pending.items():
+            output_vol = cache.load(key) if cache is not None else None
+
+            if output_vol is None:
+                output_vol = recon.run(ksp, coord, dcf, resp, work_dir=save_dir)
+
+                if cache is not None:
+                    cache.store(key, output_vol)
+
+            # The key is written once all the outputs are complete, without the cache the old one is only dropped
+            with rewriting_output(os.path.join(save_dir, f"{name}.nii.gz"), key, cache=cache):
+                save_nifti_volume(output_vol, filename=f"{name}.nii.gz", save_dir=save_dir)
+                if multiscale:
+                    save_multiscale_volume(output_vol, filename=f"{name}.zarr", save_dir=save_dir,
+                                           chunk_size=config['output'].get('chunk_size', 64))
+                else:
+                    # A pyramid left by an earlier run would no longer match the NIfTI
+                    remove_multiscale_volume(f"{name}.zarr", save_dir)
+
+        # Release the encode before the next one is handed over or loaded
+        data = ksp = coord = dcf = resp = tr = noise = None
 
     stop_time = time.time()
     logger.info(f"Total time taken: {(stop_time - start_time)/3600:.2f} hours.")
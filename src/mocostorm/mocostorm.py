@@ -1,7 +1,163 @@
 import os
+import time
+import hashlib
 import logging
+import numpy as np
+import sigpy as sp
+from recon.base import Recon
+from utils.trajectory import weight_spokes
 
 # Get the logger
 logger = logging.getLogger(__name__)
 
-logger.info(f"mocostorm")
\ No newline at end of file
+
+class MoCoStorm(Recon):
+    """
+    Motion-resolved reconstruction in a low-rank temporal subspace.
+
+    Every spoke gets a soft weight for each of `num_states` respiratory
+    states. The (spokes x states) weight matrix W is factorized as
+    W ~= phi @ basis.T with a temporal basis of `rank` columns. Only the
+    `rank` coefficient images c_k = A^H diag(phi[:, k]) D y are gridded,
+    and the state images are expanded as x_b = sum_k basis[b, k] c_k, so
+    the NUFFT cost and device memory scale with `rank`, not `num_states`.
+    """
+
+    def __init__(self,
+                img_shape=(256, 256, 256),
+                num_states=8,
+                rank=3,
+                oversamp=1.25,
+                flip=False,
+                kernel_width=2.5,
+                spoke_chunk=None,
+                device=-1
+                ):
+        # The states are binned between percentiles and the basis taken from their (num_states x num_states) Gram matrix
+        if num_states < 2:
+            raise ValueError(f"mocostorm needs at least 2 motion states, got num_states={num_states}.")
+        if not 1 <= rank <= num_states:
+            raise ValueError(f"mocostorm rank must be between 1 and num_states={num_states}, got rank={rank}.")
+
+        self.img_shape = img_shape
+        self.num_states = num_states
+        self.rank = rank
+        self.flip = flip
+        self.oversamp_factor = oversamp
+        self.kernel_width = kernel_width
+        self.spoke_chunk = spoke_chunk
+        self.device = device
+
+
+    def __get_state_weights(self, resp, margin=5):
+        # Estimate the standard deviation of the data using median based estimator
+        sigma = 1.4628 * np.median(np.abs(resp - np.median(resp)))   # float
+        # Standardize the signal with approx. unit variance and zero median and flips the signal
+        resp = -1 * (resp - np.median(resp)) / sigma
+        if self.flip:
+            resp *= -1
+
+        # Exclude the extreme values at both ends to bin robustly
+        thresh_extreme = [np.percentile(resp, margin), np.percentile(resp, 100 - margin)]
+        idx_exclude = (resp < thresh_extreme[0]) | (resp >= thresh_extreme[1])
+
+        # Motion states with equal number of spokes, centered on the median of each bin
+        edges = np.percentile(resp[~idx_exclude], np.linspace(0, 100, self.num_states + 1))
+        centers = (edges[:-1] + edges[1:]) / 2
+        width = np.mean(np.diff(centers))
+
+        weights = np.exp(-0.5 * ((resp[:, None] - centers[None, :]) / width) ** 2)
+        weights[idx_exclude] = 0
+        # Give every state the weight of one bin of spokes
+        weights *= (resp.shape[0] / self.num_states) / weights.sum(axis=0, keepdims=True)
+
+        return weights
+
+
+    def get_subspace(self, resp, subspace_path=None):
+        """
+        Estimate the temporal subspace of the respiratory signal.
+
+        Parameters:
+        -----------
+            resp : np.ndarray
+                Respiratory signal of shape (num_traj, ).
+
+            subspace_path : str
+                .npz file caching the subspace of this encode. It is reused
+                when it was computed from the same signal and parameters.
+
+        Returns:
+        --------
+            phi : np.ndarray
+                Subspace coefficient of every spoke of shape (num_traj, rank).
+
+            basis : np.ndarray
+                Temporal basis of shape (num_states, rank).
+        """
+        key = hashlib.sha256(np.ascontiguousarray(resp).tobytes())
+        key.update(f"{self.num_states}:{self.rank}:{self.flip}".encode())
+        key = key.hexdigest()
+
+        if subspace_path is not None and os.path.exists(subspace_path):
+            with np.load(subspace_path) as f:
+                if str(f["key"]) == key:
+                    logger.info(f"Loading the cached temporal subspace from {subspace_path}.")
+                    return f["phi"], f["basis"]
+
+        weights = self.__get_state_weights(resp)
+
+        # Eigen-decomposition of the small (num_states x num_states) Gram matrix gives the right singular vectors of W
+        eigvals, eigvecs = np.linalg.eigh(weights.T @ weights)
+        order = np.argsort(eigvals)[::-1][:self.rank]
+        basis = eigvecs[:, order]
+        phi = weights @ basis
+
+        energy = eigvals[order].sum() / eigvals.sum()
+        logger.info(f"Temporal subspace of rank {self.rank} captures {100 * energy:.2f}% of the state weight energy.")
+
+        if subspace_path is not None:
+            np.savez(subspace_path, key=key, phi=phi, basis=basis)
+
+        return phi, basis
+
+
+    def run(self, ksp, coord, dcf, resp, work_dir=None):
+        start_time = time.time()
+
+        logger.info(f"Performing mocostorm reconstructions ...")
+        # Cache the temporal subspace with the encode's outputs
+        subspace_path = None if work_dir is None else os.path.join(work_dir, "mocostorm_subspace.npz")
+        phi, basis = self.get_subspace(resp, subspace_path=subspace_path)
+
+        if self.spoke_chunk is None:
+            coord = sp.to_device(coord, device=self.device)
+        num_coils = ksp.shape[0]
+        xp = sp.Device(self.device).xp
+        # DCF weighted by each basis vector, shared by all coils
+        dcf_basis = [weight_spokes(dcf, phi[:, k]) for k in range(self.rank)]
+
+        with sp.Device(self.device):
+            img = np.zeros((self.num_states, *self.img_shape), dtype=np.float64)
+            basis_device = sp.to_device(basis, device=self.device)
+
+            for coil in range(0, num_coils):
+                logger.info(f"Performing mocostorm reconstruction for coil {coil}.")
+                # Coefficient images of the subspace, one adjoint NUFFT per basis vector
+                coeffs = xp.stack([self._coil_adjoint(ksp[coil], coord, dcf_basis[k]) for k in range(self.rank)])
+
+                # Expand the motion state images from the coefficients
+                for state in range(self.num_states):
+                    img_state = xp.tensordot(basis_device[state].astype(coeffs.dtype), coeffs, axes=1)
+                    img[state] += sp.to_device(xp.abs(img_state) ** 2, device=-1)
+
+            img = np.sqrt(img)
+
+        del coeffs, img_state, dcf_basis, dcf, coord, ksp
+        # (x, y, z, states) as for the gated NIfTI outputs
+        img = np.transpose(img, (3, 2, 1, 0))
+
+        stop_time = time.time()
+        logger.info(f"Finished mocostorm reconstruction! Took: {(stop_time - start_time)/3600:.2f} hours.")
+
+        return img
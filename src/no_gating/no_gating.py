@@ -8,31 +8,31 @@ from recon.base import Recon
 logger = logging.getLogger(__name__)
 
 class NoGating(Recon):
-    def __init__(self, img_shape=(256, 256, 256), oversamp=1.25, kernel_width=4, device=-1):
+    def __init__(self, img_shape=(256, 256, 256), oversamp=1.25, kernel_width=4, spoke_chunk=None, device=-1):
         self.img_shape = img_shape
         self.oversamp_factor = oversamp
         self.kernel_width = kernel_width
+        self.spoke_chunk = spoke_chunk
         self.device = device
 
-    def run(self, ksp, coord, dcf):
+    def run(self, ksp, coord, dcf, resp=None, work_dir=None):
         start_time = time.time()
 
         logger.info(f"Performing no_gating reconstructions ...")
-        coord = sp.to_device(coord, device=self.device)
-        ksp = ksp * dcf
+        if self.spoke_chunk is None:
+            coord = sp.to_device(coord, device=self.device)
         num_coils = ksp.shape[0]
         xp = sp.Device(self.device).xp
         with sp.Device(self.device):
             img = 0
             for coil in range(0, num_coils):
                 logger.info(f"Performing no_gating reconstruction for coil {coil}.")
-                ksp_coil = sp.to_device(ksp[coil], device=self.device)
-                img_coil = sp.nufft_adjoint(ksp_coil, coord, oshape=self.img_shape, oversamp=self.oversamp_factor, width=self.kernel_width)
+                img_coil = self._coil_adjoint(ksp[coil], coord, dcf)
                 img = img + sp.to_device(img_coil * xp.conj(img_coil), device=-1)
             
             img = np.abs(np.sqrt(img))
         
-        del img_coil, ksp_coil, dcf, coord, ksp
+        del img_coil, dcf, coord, ksp
         img = np.transpose(img, (2, 1, 0))
         
         stop_time = time.time()
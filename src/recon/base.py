@@ -1,3 +1,5 @@
+import numpy as np
+import sigpy as sp
 from abc import ABC, abstractmethod
 
 class Recon(ABC):
@@ -6,7 +8,86 @@ class Recon(ABC):
     def __init__(self):
         pass
 
+    def get_params(self):
+        """Return the parameters that determine the reconstruction output."""
+        # The device and the chunking do not change the output
+        return {k: v for k, v in vars(self).items() if k not in ("device", "spoke_chunk")}
+
+    def _get_oversamp_shape(self):
+        return [int(np.ceil(self.oversamp_factor * i)) for i in self.img_shape]
+
+    def _get_beta(self):
+        # Kaiser-Bessel parameter, same as sigpy.nufft_adjoint
+        return np.pi * (((self.kernel_width / self.oversamp_factor) * (self.oversamp_factor - 0.5)) ** 2 - 0.8) ** 0.5
+
+    def _grid(self, ksp_coil, coord, dcf, start, stop):
+        """Grid the density compensated spokes [start, stop) of a coil onto the oversampled grid."""
+        xp = sp.Device(self.device).xp
+        os_shape = self._get_oversamp_shape()
+
+        ksp_block = sp.to_device(ksp_coil[start:stop] * dcf[start:stop], device=self.device)
+        coord_block = sp.to_device(coord[start:stop], device=self.device)
+
+        # Scale the coordinates to the oversampled grid, as in sigpy.nufft_adjoint
+        scaled_coord = xp.array(coord_block, copy=True)
+        for i in range(-len(self.img_shape), 0):
+            scaled_coord[..., i] *= os_shape[i] / self.img_shape[i]
+            scaled_coord[..., i] += os_shape[i] // 2
+
+        grid = sp.gridding(ksp_block, scaled_coord, os_shape, kernel="kaiser_bessel", width=self.kernel_width, param=self._get_beta())
+        grid /= self.kernel_width ** len(self.img_shape)
+
+        return grid
+
+    def _grid_to_image(self, grid):
+        """Inverse FFT, crop and apodize a gridded k-space, as in sigpy.nufft_adjoint."""
+        xp = sp.Device(self.device).xp
+        ndim = len(self.img_shape)
+        os_shape = self._get_oversamp_shape()
+        beta = self._get_beta()
+
+        img = sp.ifft(grid, axes=range(-ndim, 0), norm=None)
+        img = sp.resize(img, self.img_shape)
+        img *= np.prod(os_shape) / np.prod(self.img_shape) ** 0.5
+
+        for a in range(-ndim, 0):
+            i = img.shape[a]
+            idx = xp.arange(i, dtype=img.dtype)
+            apod = (beta ** 2 - (np.pi * self.kernel_width * (idx - i // 2) / os_shape[a]) ** 2) ** 0.5
+            apod /= xp.sinh(apod)
+            img *= apod.reshape([i] + [1] * (-a - 1))
+
+        return img
+
+    def _coil_adjoint(self, ksp_coil, coord, dcf):
+        """
+        Density compensated adjoint NUFFT of a single coil.
+
+        The spokes are gridded `spoke_chunk` at a time into one oversampled
+        grid, so that only one chunk of k-space and coordinates has to be on
+        the device, and the grid is transformed to the image once. If
+        `spoke_chunk` is None, all spokes are gridded at once.
+        """
+        num_spokes = ksp_coil.shape[0]
+        spoke_chunk = self.spoke_chunk or num_spokes
+
+        grid = None
+        for start in range(0, num_spokes, spoke_chunk):
+            stop = min(start + spoke_chunk, num_spokes)
+            if grid is None:
+                grid = self._grid(ksp_coil, coord, dcf, start, stop)
+            else:
+                grid += self._grid(ksp_coil, coord, dcf, start, stop)
+
+        return self._grid_to_image(grid)
+
     @abstractmethod
-    def run(self):
-        """Execute the reconstruction and return outputs."""
+    def run(self, ksp, coord, dcf, resp=None, work_dir=None):
+        """
+        Execute the reconstruction and return outputs.
+
+        Every reconstruction takes the same arguments, those it does not
+        need are ignored. `work_dir` is a directory where it may keep
+        intermediate files of this encode.
+        """
         pass
@@ -0,0 +1,54 @@
+from no_gating.no_gating import NoGating
+from hard_gating.hard_gating import HardGating
+from soft_gating.soft_gating import SoftGating
+from sliding_window.sliding_window import SlidingWindow
+from mocostorm.mocostorm import MoCoStorm
+
+
+def build_recons(config, device, nufft_params=None):
+    """
+    Create the reconstruction objects enabled in the configuration.
+
+    Parameters:
+    -----------
+        config : dict
+            Dictionary containing the global parameters.
+
+        device : sigpy.Device or int
+            Computing device.
+
+        nufft_params : dict
+            Tuned `oversamp` and `kernel_width` shared by all reconstructions.
+            If None, every class keeps its own defaults.
+
+    Returns:
+    --------
+        recons : dict
+            Mapping of reconstruction name to the configured `Recon` object.
+    """
+    recons = {}
+    img_shape = config['output']['img_shape']
+    nufft_params = nufft_params or {}
+
+    if config['reconstructions']['no_gating']:
+        recons["no_gating"] = NoGating(img_shape=img_shape, device=device, **nufft_params)
+
+    if config['reconstructions']['hard_gating']:
+        recons["hard_gating"] = HardGating(img_shape=img_shape, gating_thresh=config['hard_gating']['thresh'], device=device, **nufft_params)
+
+    if config['reconstructions']['soft_gating']:
+        gating_thresh = config['soft_gating']['thresh']
+        gating_weight = config['soft_gating']['gating_weight']
+        recons["soft_gating"] = SoftGating(img_shape=img_shape, gating_thresh=gating_thresh, gating_weight=gating_weight, device=device, **nufft_params)
+
+    if config['reconstructions'].get('sliding_window', False):
+        window = config['sliding_window']['window']
+        stride = config['sliding_window']['stride']
+        recons["sliding_window"] = SlidingWindow(img_shape=img_shape, window=window, stride=stride, device=device, **nufft_params)
+
+    if config['reconstructions'].get('mocostorm', False):
+        num_states = config['mocostorm']['num_states']
+        rank = config['mocostorm']['rank']
+        recons["mocostorm"] = MoCoStorm(img_shape=img_shape, num_states=num_states, rank=rank, device=device, **nufft_params)
+
+    return recons
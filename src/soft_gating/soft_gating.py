@@ -5,6 +5,7 @@ import logging
 import numpy as np
 import sigpy as sp
 from recon.base import Recon
+from utils.trajectory import weight_spokes
 
 # Get the logger
 logger = logging.getLogger(__name__)
@@ -18,6 +19,7 @@ class SoftGating(Recon):
                 oversamp=1.25, 
                 flip=False, 
                 kernel_width=2.5, 
+                spoke_chunk=None, 
                 device=-1
                 ):
         self.img_shape = img_shape
@@ -26,6 +28,7 @@ class SoftGating(Recon):
         self.flip = flip
         self.oversamp_factor = oversamp
         self.kernel_width = kernel_width
+        self.spoke_chunk = spoke_chunk
         self.device = device
 
     
@@ -55,13 +58,12 @@ class SoftGating(Recon):
 
 
     def __get_gated_array(self, mask, ksp, coord, dcf):
-        mask = np.broadcast_to(mask[..., None], mask.shape + (ksp.shape[2], ))
-        dcf = dcf * mask
+        dcf = weight_spokes(dcf, mask)
         
         return ksp, coord, dcf
 
     
-    def run(self, ksp, coord, dcf, resp):
+    def run(self, ksp, coord, dcf, resp, work_dir=None):
         start_time = time.time()
 
         ksp = copy.deepcopy(ksp)
@@ -76,8 +78,8 @@ class SoftGating(Recon):
         del ksp, coord, dcf, resp
 
         logger.info(f"Performing soft_gating reconstructions ...")
-        gated_coord = sp.to_device(gated_coord, device=self.device)
-        gated_ksp = gated_ksp * gated_dcf
+        if self.spoke_chunk is None:
+            gated_coord = sp.to_device(gated_coord, device=self.device)
         num_coils = gated_ksp.shape[0]
         xp = sp.Device(self.device).xp
 
@@ -85,13 +87,12 @@ class SoftGating(Recon):
             img = 0
             for coil in range(0, num_coils):
                 logger.info(f"Performing soft_gating reconstruction for coil {coil}.")
-                ksp_coil = sp.to_device(gated_ksp[coil], device=self.device)
-                img_coil = sp.nufft_adjoint(ksp_coil, gated_coord, oshape=self.img_shape, oversamp=self.oversamp_factor, width=self.kernel_width)
+                img_coil = self._coil_adjoint(gated_ksp[coil], gated_coord, gated_dcf)
                 img = img + sp.to_device(img_coil * xp.conj(img_coil), device=-1)
             
             img = np.abs(np.sqrt(img))
         
-        del img_coil, ksp_coil, gated_dcf, gated_coord, gated_ksp
+        del img_coil, gated_dcf, gated_coord, gated_ksp
         img = np.transpose(img, (2, 1, 0))
         
         stop_time = time.time()
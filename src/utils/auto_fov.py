@@ -11,6 +11,7 @@ logger = logging.getLogger(__name__)
 
 # Load the internal modules
 from utils.misc import minmax_normalize
+from utils.trajectory import estimate_shape
 
 # Get the largest connected component (object)
 def largest_cc(mask):
@@ -44,11 +45,11 @@ def auto_fov(ksp,
                 - num_traj is the number of trajectories, 
                 - num_readouts is the number of readouts.
         
-        coord : np.ndarray
+        coord : np.ndarray or RadialTrajectory
             k-space coordinates of shape (num_traj, num_readouts, num_dim)
             where - num_dim is the k-space coordinates shape.
         
-        dcf : np.ndarray
+        dcf : np.ndarray or RadialDcf
             Density compensation factor of shape (num_traj, num_readouts)
         
         num_readouts : int
@@ -88,7 +89,7 @@ def auto_fov(ksp,
             readout_range = slice(0, num_readouts, 1)
             logger.info(f"Readout range: {readout_range}")
 
-        logger.info(f"Estimated FOV: {sp.estimate_shape(coord)}")
+        logger.info(f"Estimated FOV: {estimate_shape(coord)}")
 
         ksp_cropped = ksp[:, :, readout_range]
         coord_cropped = coord[:, readout_range, :]
@@ -178,7 +179,7 @@ def auto_fov(ksp,
 
         # Rescale (<1 = reduce FOV i.e. zooms in on the object and vice-versa)
         coord *= img_scale
-        logger.info(f"Auto FOV output shape: {sp.estimate_shape(coord)}.")
+        logger.info(f"Auto FOV output shape: {estimate_shape(coord)}.")
 
         # Reconstruct the image again at the new (smaller) FOV
         coord_cropped = coord[:, readout_range, :]
@@ -0,0 +1,276 @@
+import os
+import sys
+import json
+import hashlib
+import inspect
+import logging
+import numpy as np
+import sigpy as sp
+from contextlib import contextmanager
+
+# Get the logger
+logger = logging.getLogger(__name__)
+
+# Load the internal modules
+from utils.trajectory import RadialTrajectory, RadialDcf, compact_arrays
+
+# Bump this to invalidate every cached result (e.g. after changing the output format)
+CACHE_VERSION = 1
+
+
+def fingerprint_arrays(arrays, block_size=1 << 20, num_blocks=64):
+    """
+    Compute a content fingerprint of named arrays.
+
+    Small arrays are hashed completely. For large arrays (k-space is often
+    several gigabytes) the shape, dtype and `num_blocks` evenly spaced
+    blocks of bytes are hashed, which is enough to tell exams and
+    re-conversions apart without reading all the data.
+
+    Parameters:
+    -----------
+        arrays : dict
+            Mapping of array name to array, possibly memory-mapped.
+
+        block_size : int
+            Number of bytes read per sampled block.
+
+        num_blocks : int
+            Number of sampled blocks per large array.
+
+    Returns:
+    --------
+        fingerprint : str
+            Hex digest identifying the input data.
+    """
+    digest = hashlib.sha256()
+
+    for name in sorted(arrays):
+        x = np.asarray(arrays[name])
+        digest.update(f"{name}:{x.dtype.str}:{x.shape}".encode())
+
+        data = np.ascontiguousarray(x).reshape(-1).view(np.uint8)
+        if data.size <= block_size * num_blocks:
+            digest.update(data)
+        else:
+            for offset in np.linspace(0, data.size - block_size, num_blocks).astype(np.int64):
+                digest.update(data[offset:offset + block_size])
+
+    return digest.hexdigest()
+
+
+def fingerprint_files(data_dir, **kwargs):
+    """
+    Compute the content fingerprint of the .npy/.npz files of an encode.
+    The .npy files are memory-mapped, so only the sampled blocks are read.
+    The result matches `fingerprint_encode` on the loaded arrays.
+    """
+    arrays = {}
+    for filename in sorted(os.listdir(data_dir)):
+        path = os.path.join(data_dir, filename)
+        name, ext = os.path.splitext(filename)
+        if ext == ".npy":
+            arrays[name] = np.load(path, mmap_mode="r")
+        elif ext == ".npz":
+            with np.load(path) as f:
+                arrays.update({f"{name}.{k}": f[k] for k in f.files})
+
+    return fingerprint_arrays(arrays, **kwargs)
+
+
+def fingerprint_encode(ksp, coord, dcf, resp, tr, noise, **kwargs):
+    """
+    Compute the content fingerprint of the in-memory arrays of an encode,
+    named as the files `convert_ute` would write for them.
+    """
+    arrays = {"ksp": ksp, "resp": resp, "tr": tr, "noise": noise}
+    arrays.update({f"traj.{k}": v for k, v in compact_arrays(coord=coord, dcf=dcf).items()})
+    if not isinstance(coord, RadialTrajectory):
+        arrays["coord"] = coord
+    if not isinstance(dcf, RadialDcf):
+        arrays["dcf"] = dcf
+
+    return fingerprint_arrays(arrays, **kwargs)
+
+
+def _get_code_modules(recon):
+    """
+    Return the modules of a reconstruction class and of its base classes,
+    with the repository modules they import from (e.g. utils.trajectory).
+    """
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    modules = {}
+    for cls in type(recon).__mro__:
+        # Skip `object` and `ABC`, they are not part of this repository
+        if cls.__module__ in ("builtins", "abc"):
+            continue
+        module = sys.modules[cls.__module__]
+        modules[module.__name__] = module
+
+        for value in vars(module).values():
+            dependency = inspect.getmodule(value)
+            path = getattr(dependency, "__file__", None)
+            if path is not None and os.path.abspath(path).startswith(src_dir + os.sep):
+                modules[dependency.__name__] = dependency
+
+    return [modules[name] for name in sorted(modules)]
+
+
+def code_version(recon):
+    """
+    Hash the source of the modules a reconstruction class depends on (see
+    `_get_code_modules`) and the numpy and sigpy versions, so that code
+    changes invalidate results.
+    """
+    digest = hashlib.sha256(f"cache-v{CACHE_VERSION}:numpy-{np.__version__}:sigpy-{sp.__version__}".encode())
+    for module in _get_code_modules(recon):
+        with open(inspect.getsourcefile(module), "rb") as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+def make_cache_key(fingerprint, name, recon):
+    """
+    Build the cache key of a reconstruction output.
+
+    Parameters:
+    -----------
+        fingerprint : str
+            Fingerprint of the input data (see `fingerprint_arrays`).
+
+        name : str
+            Name of the reconstruction algorithm.
+
+        recon : recon.base.Recon
+            Configured reconstruction object.
+
+    Returns:
+    --------
+        key : str
+            Hex digest identifying the output.
+    """
+    payload = json.dumps({
+        "data": fingerprint,
+        "algorithm": name,
+        "params": recon.get_params(),
+        "code": code_version(recon),
+        }, sort_keys=True, default=str)
+
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def clear_cache_key(output_path):
+    """Remove the key sidecar of an output, e.g. after it was rebuilt without the cache."""
+    key_path = output_path + ".key"
+    if os.path.exists(key_path):
+        os.remove(key_path)
+
+
+@contextmanager
+def rewriting_output(output_path, key=None, cache=None):
+    """
+    Context of rewriting an output. The old key is removed before the output
+    is touched and the new one recorded only once the block completes, so an
+    interrupted write never leaves a new volume under an old key.
+
+    Parameters:
+    -----------
+        output_path : str
+            Path of the output the key sidecar belongs to.
+
+        key : str
+            Cache key of the new output, None without the cache.
+
+        cache : ResultCache
+            Cache recording the key, None without the cache.
+    """
+    clear_cache_key(output_path)
+    yield
+    if cache is not None and key is not None:
+        cache.mark_current(output_path, key)
+
+
+class ResultCache:
+    """
+    Content-addressed cache of reconstruction outputs.
+
+    Every saved output gets a `<output>.key` sidecar holding the key it was
+    built from, so an output whose key is unchanged can be skipped. The raw
+    reconstructed volumes (the intermediates) are also kept in `cache_dir`
+    as `<key>.npy`, and the least recently used ones are evicted once the
+    directory grows beyond `max_size_gb`.
+    """
+
+    def __init__(self, cache_dir, max_size_gb=20.0):
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_gb * 1024 ** 3)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+
+    def __volume_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+
+    def is_current(self, output_path, key):
+        """Check whether `output_path` exists and was built from `key`."""
+        key_path = output_path + ".key"
+        if not (os.path.exists(output_path) and os.path.exists(key_path)):
+            return False
+
+        with open(key_path, "r") as f:
+            return f.read().strip() == key
+
+
+    def mark_current(self, output_path, key):
+        """Record that `output_path` was built from `key`."""
+        with open(output_path + ".key", "w") as f:
+            f.write(key)
+
+
+    def load(self, key):
+        """Return the cached volume of `key` or None on a miss."""
+        path = self.__volume_path(key)
+        if not os.path.exists(path):
+            return None
+
+        logger.info(f"Loading cached volume {key[:12]} from {self.cache_dir}.")
+        # Refresh the access time used for the LRU eviction
+        os.utime(path)
+
+        return np.load(path)
+
+
+    def store(self, key, volume):
+        """Store a reconstructed volume and evict old entries if needed."""
+        volume = np.asarray(volume)
+        if volume.nbytes > self.max_size:
+            logger.info(f"Volume of {volume.nbytes / 1024 ** 3:.2f} GB exceeds the cache size, not caching.")
+            return
+
+        path = self.__volume_path(key)
+        # Write to a temporary file first so that an interrupted run never leaves a truncated entry
+        tmp_path = path + ".tmp.npy"
+        np.save(tmp_path, volume)
+        os.replace(tmp_path, path)
+
+        self.evict()
+
+
+    def evict(self):
+        """Remove the least recently used volumes until the cache fits `max_size`."""
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(".npy") or filename.endswith(".tmp.npy"):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, filename))
+            entries.append((stat.st_mtime, stat.st_size, filename))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            logger.info(f"Evicting cached volume {filename} from {self.cache_dir}.")
+            os.remove(os.path.join(self.cache_dir, filename))
+            total_size -= size
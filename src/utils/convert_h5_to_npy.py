@@ -1,32 +1,42 @@
 import os
 import h5py
+import queue
 import logging
+import threading
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
+# Load the internal modules
+from utils.trajectory import RadialTrajectory, RadialDcf, save_compact
 
 # Get the logger for logging
 logger = logging.getLogger(__name__)
 
-def convert_ute(h5_path, 
-                output_dir, 
-                spoke_downsample_factor=1.0,
-                pre_whiten=False, 
-                apodise=False,
-                compress_coils=False
-                ):
+def iter_ute(h5_path, 
+             spoke_downsample_factor=1.0,
+             pre_whiten=False, 
+             apodise=False,
+             compress_coils=False,
+             compact_traj=True
+             ):
     """
-    Convert MRI_Raw.h5 file to ksp.npy, coord.npy, dcf.npy, tr.npy, noise.npy 
-    and resp.npy files.
+    Read the MRI_Raw.h5 file one encode at a time.
 
     Parameters:
     -----------
     h5_path (str): path of the MRI_Raw.h5 file. 
-    output_dir (str): path to save the output files.
+    compact_traj (bool): return radial coordinates and DCF as RadialTrajectory 
+        and RadialDcf, when they are radial.
+
+    Yields:
+    -------
+    encode (int): index of the encode.
+    data (tuple): ksp, coord, dcf, resp, tr and noise arrays, as load_npy_files 
+        returns them.
     """
-    logger.info(f"Converting {h5_path} file to npy files ...")
+    logger.info(f"Converting {h5_path} file ...")
 
     noise = 0
-    os.makedirs(output_dir, exist_ok=True)
 
     with h5py.File(h5_path, "r") as hf:
         logger.info(f"Reading the MRI_Raw.h5 file ...")
@@ -64,8 +74,6 @@ def convert_ute(h5_path,
 
         for encode in range(num_encodes):
             logger.info(f"Processing encode {encode} ...")
-            encode_dir = os.path.join(output_dir, f"encode_{encode}")
-            os.makedirs(encode_dir, exist_ok=True)
 
             try:
                 time = np.squeeze(hf["Gating"][f"time"])
@@ -133,12 +141,142 @@ def convert_ute(h5_path,
             tr = d_time[1] - d_time[0]
             logger.info(f"Time of repetition: {tr}.")
 
-            # === Save the npy files ===
-            np.save(os.path.join(encode_dir, "ksp.npy"), ksp)
-            np.save(os.path.join(encode_dir, "coord.npy"), coord)
-            np.save(os.path.join(encode_dir, "dcf.npy"), dcf)
-            np.save(os.path.join(encode_dir, "resp.npy"), resp / resp.max())
-            np.save(os.path.join(encode_dir, "tr.npy"), np.array([tr]))
-            np.save(os.path.join(encode_dir, "noise.npy"), noise)
+            # Keep the dense arrays when the trajectory or DCF are not radial
+            if compact_traj:
+                compact_coord = RadialTrajectory.from_dense(coord)
+                compact_dcf = RadialDcf.from_dense(dcf)
+                coord = coord if compact_coord is None else compact_coord
+                dcf = dcf if compact_dcf is None else compact_dcf
+
+            yield encode, (ksp, coord, dcf, resp / resp.max(), np.array([tr]), np.asarray(noise))
+
+
+def save_encode(encode_dir, ksp, coord, dcf, resp, tr, noise):
+    """
+    Save the arrays of an encode as ksp.npy, coord.npy, dcf.npy, tr.npy, 
+    noise.npy and resp.npy files. Compact coordinates and DCF are saved 
+    in traj.npz instead of coord.npy and dcf.npy.
+    """
+    os.makedirs(encode_dir, exist_ok=True)
+
+    # Remove the trajectory files of a previous conversion, it may have used the other format
+    for filename in ("coord.npy", "dcf.npy", "traj.npz"):
+        if os.path.exists(os.path.join(encode_dir, filename)):
+            os.remove(os.path.join(encode_dir, filename))
+
+    np.save(os.path.join(encode_dir, "ksp.npy"), ksp)
+    if isinstance(coord, RadialTrajectory) or isinstance(dcf, RadialDcf):
+        save_compact(os.path.join(encode_dir, "traj.npz"), coord=coord, dcf=dcf)
+    if not isinstance(coord, RadialTrajectory):
+        np.save(os.path.join(encode_dir, "coord.npy"), coord)
+    if not isinstance(dcf, RadialDcf):
+        np.save(os.path.join(encode_dir, "dcf.npy"), dcf)
+    np.save(os.path.join(encode_dir, "resp.npy"), resp)
+    np.save(os.path.join(encode_dir, "tr.npy"), tr)
+    np.save(os.path.join(encode_dir, "noise.npy"), noise)
 
-            logger.info(f"Saved data for encode {encode} in {encode_dir}.")
+    logger.info(f"Saved data in {encode_dir}.")
+
+
+def convert_ute(h5_path, output_dir, **kwargs):
+    """
+    Convert MRI_Raw.h5 file to ksp.npy, coord.npy, dcf.npy, tr.npy, noise.npy 
+    and resp.npy files.
+
+    Parameters:
+    -----------
+    h5_path (str): path of the MRI_Raw.h5 file. 
+    output_dir (str): path to save the output files.
+    kwargs (dict): options of iter_ute.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    for encode, data in iter_ute(h5_path, **kwargs):
+        save_encode(os.path.join(output_dir, f"encode_{encode}"), *data)
+
+
+def prefetch_ute(h5_path, output_dir=None, prefetch=1, **kwargs):
+    """
+    Hand the encodes of MRI_Raw.h5 over in memory, without reading them 
+    back from disk.
+
+    The next encode is converted in a background thread while the caller 
+    processes the current one, and the npy files are written by another 
+    background thread, or not at all if `output_dir` is None. The next
+    encode is only handed over once the previous one is saved, so up to
+    `prefetch + 2` encodes are in host memory at once: the caller's (the
+    one being saved), the buffered ones and the one being converted,
+    provided the caller drops its encode before asking for the next one.
+    If the caller stops early, the conversion stops after the current
+    encode.
+
+    Parameters:
+    -----------
+    h5_path (str): path of the MRI_Raw.h5 file. 
+    output_dir (str): path to save the output files, None to skip saving.
+    prefetch (int): number of encodes converted ahead of the caller.
+    kwargs (dict): options of iter_ute.
+
+    Yields:
+    -------
+    encode_dir (str): name of the encode directory, e.g. "encode_0".
+    data (tuple): ksp, coord, dcf, resp, tr and noise arrays.
+    """
+    buffer = queue.Queue(maxsize=prefetch)
+    finished = object()
+    # Set when the caller is done, so that the converter never blocks on a full buffer
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def convert():
+        try:
+            for item in iter_ute(h5_path, **kwargs):
+                if not put(item):
+                    return
+        except Exception as err:
+            put(err)
+        else:
+            put(finished)
+
+    threading.Thread(target=convert, daemon=True).start()
+
+    try:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            save = None
+            while True:
+                # Wait for the previous save, queued saves would keep their encodes in memory
+                if save is not None:
+                    save.result()
+                    save = None
+
+                item = buffer.get()
+                if item is finished:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+
+                encode, data = item
+                if output_dir is not None:
+                    save = executor.submit(save_encode, os.path.join(output_dir, f"encode_{encode}"), *data)
+
+                yield f"encode_{encode}", data
+                # Only the save keeps the encode, it is released once written
+                item = data = None
+
+    finally:
+        stop.set()
+        # Release the encodes converted ahead of an early stop
+        while True:
+            try:
+                buffer.get_nowait()
+            except queue.Empty:
+                break
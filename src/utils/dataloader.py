@@ -2,6 +2,9 @@ import os
 import logging
 import numpy as np
 
+# Load the internal modules
+from utils.trajectory import load_compact
+
 # Get the logger
 logger = logging.getLogger(__name__)
 
@@ -11,8 +14,14 @@ def load_npy_files(processed_dir):
         
     try:
         ksp = np.load(os.path.join(processed_dir, "ksp.npy"))
-        coord = np.load(os.path.join(processed_dir, "coord.npy"))
-        dcf = np.load(os.path.join(processed_dir, "dcf.npy"))
+        # Radial trajectories may be stored in the compact traj.npz instead
+        coord, dcf = None, None
+        if os.path.exists(os.path.join(processed_dir, "traj.npz")):
+            coord, dcf = load_compact(os.path.join(processed_dir, "traj.npz"))
+        if coord is None:
+            coord = np.load(os.path.join(processed_dir, "coord.npy"))
+        if dcf is None:
+            dcf = np.load(os.path.join(processed_dir, "dcf.npy"))
         resp = np.load(os.path.join(processed_dir, "resp.npy"))
         tr = np.load(os.path.join(processed_dir, "tr.npy"))
         noise = np.load(os.path.join(processed_dir, "noise.npy"))
@@ -1,5 +1,6 @@
 import os
 import yaml
+import shutil
 import logging
 import numpy as np
 import nibabel as nib
@@ -98,3 +99,95 @@ def save_nifti_volume(volume, filename=None, save_dir=None):
     output_path = os.path.join(save_dir, filename)
     nib.save(nifti_volume, output_path)
 
+
+
+def downsample_volume(volume, factor=2):
+    """
+    Downsample the last three axes of a volume by averaging blocks of
+    `factor` voxels. Trailing voxels that do not fill a block are dropped.
+    """
+    shape = volume.shape[:-3]
+    slices = [slice(None)] * (volume.ndim - 3)
+    for size in volume.shape[-3:]:
+        shape += (size // factor, factor)
+        slices.append(slice(0, size // factor * factor))
+
+    blocks = volume[tuple(slices)].reshape(shape)
+
+    return blocks.mean(axis=(-5, -3, -1))
+
+
+def save_multiscale_volume(volume, filename=None, save_dir=None, chunk_size=64):
+    """
+    Save an input volume as a chunked Zarr store with a multiscale pyramid.
+
+    Every level halves the last three axes of the previous one until they
+    fit in a single chunk. The store follows the OME-Zarr `multiscales`
+    layout, so viewers can fetch single chunks or low resolution levels
+    without reading the full volume.
+
+    The volumes are in (x, y, z) order as for NIfTI, with the frames or
+    motion states last. They are stored in the (t, z, y, x) order of
+    OME-Zarr. The store is written under a temporary name and renamed when
+    complete, so an existing store is never a partial one.
+
+    Args:
+        volume (numpy.ndarray) : Input volume
+        filename (str) : Name of the store to be saved.
+        save_dir (str) : Path of the output directory
+        chunk_size (int) : Chunk size along each spatial axis.
+    """
+    # Optional dependency, only needed for this output format
+    import zarr
+
+    if filename is None:
+        filename = "default_name.zarr"
+
+    if save_dir is None:
+        save_dir = os.getcwd()
+
+    logger.info(f"Saving multiscale {filename} at {save_dir}.")
+    output_path = os.path.join(save_dir, filename)
+    tmp_path = output_path + ".tmp"
+    # OME-Zarr 0.4 is defined for Zarr v2 stores, while zarr>=3 writes v3 by default
+    if int(zarr.__version__.split(".")[0]) >= 3:
+        group = zarr.open_group(tmp_path, mode="w", zarr_format=2)
+        create_array = group.create_array
+    else:
+        group = zarr.open_group(tmp_path, mode="w")
+        create_array = group.create_dataset
+
+    # Same intensity scaling as the NIfTI output, stored as 8-bit, with the axes reversed to (t, z, y, x)
+    level = np.transpose(minmax_normalize(volume, 0, 255))
+    num_extra = volume.ndim - 3
+    axes = [{"name": "t", "type": "time"}] * num_extra + [{"name": i, "type": "space"} for i in ("z", "y", "x")]
+
+    datasets = []
+    scale = 1
+    while True:
+        path = str(len(datasets))
+        chunks = (1, ) * num_extra + tuple(min(chunk_size, i) for i in level.shape[-3:])
+        array = create_array(name=path, shape=level.shape, chunks=chunks, dtype=np.uint8, fill_value=0)
+        array[...] = np.round(np.nan_to_num(level)).astype(np.uint8)
+        datasets.append({"path": path,
+                         "coordinateTransformations": [{"type": "scale", "scale": [1] * num_extra + [scale] * 3}]})
+
+        if max(level.shape[-3:]) <= chunk_size or min(level.shape[-3:]) < 2:
+            break
+        level = downsample_volume(level)
+        scale *= 2
+
+    group.attrs["multiscales"] = [{"version": "0.4", "name": os.path.splitext(filename)[0], "axes": axes, "datasets": datasets}]
+
+    if os.path.exists(output_path):
+        shutil.rmtree(output_path)
+    os.rename(tmp_path, output_path)
+    logger.info(f"Saved {len(datasets)} pyramid levels in {output_path}.")
+
+
+def remove_multiscale_volume(filename, save_dir):
+    """Remove the multiscale store of an output, e.g. when the output is rewritten without it."""
+    output_path = os.path.join(save_dir, filename)
+    if os.path.exists(output_path):
+        logger.info(f"Removing outdated {filename} at {save_dir}.")
+        shutil.rmtree(output_path)
@@ -0,0 +1,227 @@
+import os
+import time
+import yaml
+import argparse
+import logging
+import numpy as np
+import sigpy as sp
+
+# Get the logger
+logger = logging.getLogger(__name__)
+
+# Default search grid and high-accuracy reference
+OVERSAMPS = (1.25, 1.5, 2.0)
+KERNEL_WIDTHS = (2, 2.5, 3, 4, 5, 6)
+REF_OVERSAMP = 2.0
+REF_KERNEL_WIDTH = 8
+
+
+def get_tuning_file(config, config_path):
+    """Return the path of the NUFFT tuning table for a configuration."""
+    tuning_file = config.get("nufft", {}).get("tuning_file")
+    if tuning_file is None:
+        tuning_file = os.path.join(os.path.dirname(os.path.abspath(config_path)), "nufft_tuning.yaml")
+
+    return tuning_file
+
+
+def get_table_key(trajectory, img_shape):
+    """Return the tuning table key of a trajectory type and image shape, e.g. "radial_ute/256x256x256"."""
+    return f"{trajectory}/" + "x".join(str(int(i)) for i in img_shape)
+
+
+def load_nufft_params(tuning_file, trajectory, img_shape):
+    """
+    Load the tuned NUFFT parameters of a trajectory type and image shape.
+
+    The error of a (oversamp, kernel_width) pair depends on the image
+    shape, so the parameters are only used for the shape they were tuned on.
+
+    Parameters:
+    -----------
+        tuning_file : str
+            Path of the YAML tuning table.
+
+        trajectory : str
+            Trajectory type, e.g. "radial_ute".
+
+        img_shape : list
+            Shape of the reconstructed image.
+
+    Returns:
+    --------
+        params : dict or None
+            Dictionary with `oversamp` and `kernel_width`, or None if the
+            trajectory has not been tuned for `img_shape`.
+    """
+    if not os.path.exists(tuning_file):
+        return None
+
+    with open(tuning_file, "r") as f:
+        table = yaml.safe_load(f) or {}
+
+    key = get_table_key(trajectory, img_shape)
+    entry = table.get(key)
+    if entry is None:
+        tuned = [k for k in table if k.split("/")[0] == trajectory]
+        if tuned:
+            logger.warning(f"NUFFT parameters of {trajectory} were tuned for {', '.join(tuned)}, not {key}. Using the defaults.")
+        return None
+
+    logger.info(f"Using tuned NUFFT parameters for {key}: oversamp={entry['oversamp']}, kernel_width={entry['kernel_width']}.")
+
+    return {"oversamp": entry["oversamp"], "kernel_width": entry["kernel_width"]}
+
+
+def save_nufft_params(tuning_file, trajectory, entry):
+    """Store the tuned NUFFT parameters of a trajectory type and of the image shape of `entry` in the tuning table."""
+    table = {}
+    if os.path.exists(tuning_file):
+        with open(tuning_file, "r") as f:
+            table = yaml.safe_load(f) or {}
+
+    key = get_table_key(trajectory, entry["img_shape"])
+    table[key] = entry
+    with open(tuning_file, "w") as f:
+        yaml.safe_dump(table, f, sort_keys=True)
+
+    logger.info(f"Saved NUFFT parameters for {key} in {tuning_file}.")
+
+
+def benchmark_nufft(ksp, coord, img_shape, oversamp, kernel_width, device=-1, repeats=3):
+    """
+    Time the adjoint NUFFT of a single coil.
+
+    Returns:
+    --------
+        runtime : float
+            Best runtime over `repeats` runs in seconds.
+
+        img : np.ndarray
+            Adjoint NUFFT image.
+    """
+    device = sp.Device(device)
+    runtime = np.inf
+
+    with device:
+        ksp = sp.to_device(ksp, device)
+        coord = sp.to_device(coord, device)
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            img = sp.nufft_adjoint(ksp, coord, oshape=img_shape, oversamp=oversamp, width=kernel_width)
+            if device.id >= 0:
+                device.cpdevice.synchronize()
+            runtime = min(runtime, time.perf_counter() - start_time)
+
+    return runtime, sp.to_device(img)
+
+
+def autotune_nufft(ksp,
+                   coord,
+                   dcf,
+                   img_shape,
+                   tol=1e-2,
+                   oversamps=OVERSAMPS,
+                   kernel_widths=KERNEL_WIDTHS,
+                   num_spokes=20000,
+                   device=-1):
+    """
+    Find the fastest NUFFT (oversamp, kernel_width) pair whose adjoint
+    stays within `tol` of a high-accuracy reference.
+
+    The benchmark uses the coil with the highest signal energy and an evenly
+    strided subset of the spokes, so that the full k-space coverage is kept.
+
+    Parameters:
+    -----------
+        ksp : np.ndarray
+            k-space measurements of shape (num_coil, num_traj, num_readouts).
+
+        coord : np.ndarray
+            k-space coordinates of shape (num_traj, num_readouts, num_dim).
+
+        dcf : np.ndarray
+            Density compensation factor of shape (num_traj, num_readouts).
+
+        img_shape : list
+            Shape of the reconstructed image.
+
+        tol : float
+            Maximum relative L2 error against the reference.
+
+        oversamps : tuple
+            Oversampling factors to evaluate.
+
+        kernel_widths : tuple
+            Kernel widths to evaluate.
+
+        num_spokes : int
+            Maximum number of spokes used for the benchmark.
+
+        device : sigpy.Device
+            Computing device.
+
+    Returns:
+    --------
+        best : dict
+            The selected parameters with their error and runtime.
+
+        results : list
+            Error and runtime of every evaluated pair.
+    """
+    logger.info(f"Autotuning NUFFT parameters with tolerance {tol} ...")
+
+    stride = max(1, ksp.shape[1] // num_spokes)
+    coil = int(np.argmax(np.sum(np.abs(ksp[:, ::stride]) ** 2, axis=(1, 2))))
+    ksp = ksp[coil, ::stride] * dcf[::stride]
+    coord = coord[::stride]
+
+    _, img_ref = benchmark_nufft(ksp, coord, img_shape, REF_OVERSAMP, REF_KERNEL_WIDTH, device=device, repeats=1)
+    ref_norm = np.linalg.norm(img_ref)
+
+    results = []
+    for oversamp in oversamps:
+        for kernel_width in kernel_widths:
+            runtime, img = benchmark_nufft(ksp, coord, img_shape, oversamp, kernel_width, device=device)
+            error = float(np.linalg.norm(img - img_ref) / ref_norm)
+            logger.info(f"oversamp={oversamp}, kernel_width={kernel_width}: error={error:.2e}, runtime={runtime:.3f} s.")
+            results.append({"oversamp": float(oversamp),
+                            "kernel_width": float(kernel_width),
+                            "error": error,
+                            "runtime": float(runtime)})
+
+    candidates = [r for r in results if r["error"] <= tol]
+    if not candidates:
+        raise ValueError(f"No NUFFT parameters meet the error tolerance {tol}.")
+
+    best = dict(min(candidates, key=lambda r: r["runtime"]))
+    best["tolerance"] = float(tol)
+    best["img_shape"] = [int(i) for i in img_shape]
+    logger.info(f"Selected oversamp={best['oversamp']}, kernel_width={best['kernel_width']}.")
+
+    return best, results
+
+
+if __name__ == "__main__":
+    from utils.misc import load_config
+    from utils.dataloader import load_npy_files
+
+    parser = argparse.ArgumentParser(
+        description="Tune the NUFFT oversampling and kernel width for a trajectory type."
+        )
+    parser.add_argument("-i", "--encode_dir", type=str, help="Path to a processed encode directory.")
+    parser.add_argument("--config_path", type=str, help="Path to the YAML configuration file.")
+    parser.add_argument("--tol", type=float, default=1e-2, help="Maximum relative error against the reference.")
+    parser.add_argument("--num_spokes", type=int, default=20000, help="Maximum number of spokes to benchmark.")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    config = load_config(args.config_path)
+    device = sp.Device(0) if config["device"]["gpu"] else -1
+
+    ksp, coord, dcf, resp, tr, noise = load_npy_files(args.encode_dir)
+    best, results = autotune_nufft(ksp, coord, dcf, config["output"]["img_shape"],
+                                   tol=args.tol, num_spokes=args.num_spokes, device=device)
+
+    save_nufft_params(get_tuning_file(config, args.config_path), config["nufft"]["trajectory"], best)
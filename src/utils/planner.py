@@ -0,0 +1,422 @@
+import os
+import time
+import yaml
+import argparse
+import logging
+import numpy as np
+import sigpy as sp
+
+# Get the logger
+logger = logging.getLogger(__name__)
+
+# Load the internal modules
+from utils.trajectory import load_compact
+
+# Uncalibrated fallback of the runtime model, in seconds per unit (see `estimate_runtime`)
+DEFAULT_COST_MODEL = {
+    "cpu": {"gridding": 5e-9, "fft": 2e-9, "overhead": 1.0},
+    "gpu": {"gridding": 5e-11, "fft": 5e-11, "overhead": 1.0},
+}
+
+# Smallest spoke chunk worth gridding, below this the per-chunk transfers dominate
+MIN_SPOKE_CHUNK = 1000
+
+# Smallest image size the planner downscales to
+MIN_IMG_SIZE = 64
+
+
+def read_npy_shape(path):
+    """
+    Read the shape and dtype of a .npy file from its header, without
+    loading the data.
+    """
+    with open(path, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+
+    return shape, dtype
+
+
+def get_data_shapes(data_dir):
+    """
+    Return a mapping of array name to (shape, dtype) for the .npy files of
+    an encode. Compact trajectories (traj.npz) report the shape of the
+    dense arrays they represent, and their actual size under "stored_bytes".
+    """
+    shapes = {}
+    for name in ("ksp", "coord", "dcf", "resp"):
+        path = os.path.join(data_dir, f"{name}.npy")
+        if os.path.exists(path):
+            shapes[name] = read_npy_shape(path)
+
+    traj_path = os.path.join(data_dir, "traj.npz")
+    if os.path.exists(traj_path):
+        coord, dcf = load_compact(traj_path)
+        shapes["stored_bytes"] = {}
+        for name, x in (("coord", coord), ("dcf", dcf)):
+            if x is not None:
+                shapes[name] = (x.shape, x.dtype)
+                shapes["stored_bytes"][name] = x.nbytes
+
+    return shapes
+
+
+def get_array_shapes(ksp, coord, dcf, resp):
+    """Same as `get_data_shapes` for arrays that are already in memory."""
+    shapes = {"stored_bytes": {}}
+    for name, x in (("ksp", ksp), ("coord", coord), ("dcf", dcf), ("resp", resp)):
+        shapes[name] = (x.shape, x.dtype)
+        shapes["stored_bytes"][name] = x.nbytes
+
+    return shapes
+
+
+def get_available_memory(device=-1):
+    """
+    Return the available host and device memory in bytes. On the CPU the
+    device memory is the host memory, reported as None.
+    """
+    host_mem = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    host_mem = int(line.split()[1]) * 1024
+                    break
+    except FileNotFoundError:
+        pass
+
+    device_mem = None
+    device = sp.Device(device)
+    if device.id >= 0:
+        device_mem, _ = device.cpdevice.mem_info
+        # Blocks cached by cupy's memory pool are free for this process, but the driver counts them as used
+        with device:
+            device_mem += device.xp.get_default_memory_pool().free_bytes()
+
+    return host_mem, device_mem
+
+
+def load_cost_model(cost_model_path):
+    """Load the calibrated runtime model, falling back to the defaults."""
+    cost_model = {k: dict(v) for k, v in DEFAULT_COST_MODEL.items()}
+    if cost_model_path is not None and os.path.exists(cost_model_path):
+        with open(cost_model_path, "r") as f:
+            cost_model.update(yaml.safe_load(f) or {})
+    else:
+        logger.info(f"No calibrated cost model found, using uncalibrated defaults.")
+
+    return cost_model
+
+
+def _get_oversamp_size(img_shape, oversamp):
+    return int(np.prod([np.ceil(oversamp * i) for i in img_shape]))
+
+
+def _get_array_bytes(shapes):
+    """Return the host size of the ksp, coord, dcf and resp arrays in bytes."""
+    (num_coils, num_spokes, num_readouts), ksp_dtype = shapes["ksp"]
+    stored_bytes = shapes.get("stored_bytes", {})
+    ksp_bytes = num_coils * num_spokes * num_readouts * np.dtype(ksp_dtype).itemsize
+    coord_bytes = stored_bytes.get("coord", int(np.prod(shapes["coord"][0])) * np.dtype(shapes["coord"][1]).itemsize)
+    dcf_bytes = stored_bytes.get("dcf", int(np.prod(shapes["dcf"][0])) * np.dtype(shapes["dcf"][1]).itemsize)
+    resp_bytes = int(np.prod(shapes["resp"][0])) * np.dtype(shapes["resp"][1]).itemsize
+
+    return ksp_bytes, coord_bytes, dcf_bytes, resp_bytes
+
+
+def estimate_input_memory(name, recon, shapes):
+    """
+    Estimate the host memory of the loaded input and of the copies the
+    reconstruction makes of it. It does not depend on the image shape, so
+    downscaling the image cannot reduce it.
+    """
+    ksp_bytes, coord_bytes, dcf_bytes, resp_bytes = _get_array_bytes(shapes)
+    data_bytes = ksp_bytes + coord_bytes + dcf_bytes + resp_bytes
+
+    # Loaded data, plus the deep copies and gated arrays made by the gating recons
+    host_mem = data_bytes
+    if name == "hard_gating":
+        fraction = 0.9 * recon.gating_thresh / 100
+        host_mem += data_bytes + fraction * (ksp_bytes + coord_bytes + dcf_bytes)
+    elif name == "soft_gating":
+        host_mem += data_bytes + dcf_bytes
+    elif name == "mocostorm":
+        # Subspace weighted DCF of each basis vector, built once for all coils
+        host_mem += recon.rank * dcf_bytes
+
+    return int(host_mem)
+
+
+def estimate_memory(name, recon, shapes, spoke_chunk=None):
+    """
+    Estimate the peak host and device memory of a reconstruction.
+
+    Parameters:
+    -----------
+        name : str
+            Name of the reconstruction algorithm.
+
+        recon : recon.base.Recon
+            Configured reconstruction object.
+
+        shapes : dict
+            Shapes and dtypes of the input arrays (see `get_data_shapes`).
+
+        spoke_chunk : int
+            Number of spokes gridded at once, None for all spokes.
+
+    Returns:
+    --------
+        host_mem : int
+            Peak host memory in bytes.
+
+        device_mem : int
+            Peak device memory in bytes.
+    """
+    (num_coils, num_spokes, num_readouts), ksp_dtype = shapes["ksp"]
+
+    # Fraction of the spokes kept by the gating
+    if name == "hard_gating":
+        fraction = 0.9 * recon.gating_thresh / 100
+    else:
+        fraction = 1.0
+
+    host_mem = estimate_input_memory(name, recon, shapes)
+
+    # Coil image accumulator and its magnitude/transposed copies
+    complex_size = np.dtype(np.result_type(ksp_dtype, np.complex64)).itemsize
+    img_size = int(np.prod(recon.img_shape))
+    host_mem += 3 * img_size * complex_size
+
+    if name == "sliding_window":
+        # Frame accumulators and their transposed copy, the device holds at most one window of spokes
+        host_mem += 2 * recon.get_num_frames(num_spokes) * img_size * 8
+        spoke_chunk = recon.window
+
+    if name == "mocostorm":
+        # State accumulators and their transposed copy
+        host_mem += 2 * recon.num_states * img_size * 8
+
+    # Device: one chunk of k-space and coordinates, the oversampled grid and the coil image
+    chunk = num_spokes * fraction if spoke_chunk is None else min(spoke_chunk, num_spokes * fraction)
+    spoke_bytes = num_readouts * (complex_size + shapes["coord"][0][-1] * np.dtype(shapes["coord"][1]).itemsize)
+    device_mem = (chunk * spoke_bytes
+                  + 2 * _get_oversamp_size(recon.img_shape, recon.oversamp_factor) * complex_size
+                  + 3 * img_size * complex_size)
+    if name == "mocostorm":
+        # Coefficient images of the subspace
+        device_mem += recon.rank * img_size * complex_size
+
+    return int(host_mem), int(device_mem)
+
+
+def estimate_runtime(name, recon, shapes, cost_model, device=-1):
+    """
+    Estimate the runtime of a reconstruction in seconds.
+
+    The model is `gridding * points * width^ndim + fft * grid * log2(grid)`
+    per coil and FFT, plus a fixed overhead, with the coefficients
+    calibrated by `calibrate_cost_model`. The spoke chunks are gridded
+    into one grid, so chunking adds no FFT.
+    """
+    coefs = cost_model["cpu" if sp.Device(device).id < 0 else "gpu"]
+    (num_coils, num_spokes, num_readouts), _ = shapes["ksp"]
+    ndim = shapes["coord"][0][-1]
+
+    if name == "hard_gating":
+        num_spokes = num_spokes * 0.9 * recon.gating_thresh / 100
+
+    num_ffts = 1
+    if name == "sliding_window":
+        # Every spoke is gridded when entering and when leaving the window, plus one FFT per frame
+        num_ffts = recon.get_num_frames(num_spokes)
+        num_spokes = 2 * num_spokes
+    if name == "mocostorm":
+        # One adjoint NUFFT per basis vector
+        num_spokes = recon.rank * num_spokes
+        num_ffts = recon.rank
+    grid_size = _get_oversamp_size(recon.img_shape, recon.oversamp_factor)
+
+    runtime = num_coils * (coefs["gridding"] * num_spokes * num_readouts * recon.kernel_width ** ndim
+                           + coefs["fft"] * num_ffts * grid_size * np.log2(grid_size))
+
+    return float(runtime + coefs["overhead"])
+
+
+def plan_recons(recons, shapes, cost_model=None, device=-1, memory_fraction=0.9, allow_downscale=False, reserved_host_mem=0):
+    """
+    Check that every reconstruction fits in memory, picking spoke chunk
+    sizes and, if allowed, downscaling the image shape of those that do
+    not. The reconstruction objects are updated in place.
+
+    Parameters:
+    -----------
+        recons : dict
+            Mapping of reconstruction name to the configured `Recon` object.
+
+        shapes : dict
+            Shapes and dtypes of the input arrays (see `get_data_shapes`).
+
+        cost_model : dict
+            Runtime model coefficients (see `load_cost_model`).
+
+        device : sigpy.Device
+            Computing device.
+
+        memory_fraction : float
+            Fraction of the available memory the plan may use.
+
+        allow_downscale : bool
+            Reduce the image shape of jobs that do not fit instead of refusing them.
+
+        reserved_host_mem : int
+            Host memory in bytes held outside the reconstruction, e.g. by
+            the encodes buffered by the conversion pipeline.
+
+    Returns:
+    --------
+        plan : dict
+            Estimated memory (GB), runtime (hours), spoke chunk and image
+            shape per reconstruction.
+    """
+    cost_model = cost_model or DEFAULT_COST_MODEL
+    host_avail, device_avail = get_available_memory(device)
+    host_budget = memory_fraction * host_avail - reserved_host_mem
+
+    plan = {}
+    for name, recon in recons.items():
+        # Downscaling only reduces the image terms, refuse right away if the input alone does not fit
+        input_mem = estimate_input_memory(name, recon, shapes)
+        if input_mem > host_budget:
+            raise MemoryError(f"{name} needs {input_mem / 1024 ** 3:.1f} GB host memory for the input data alone, "
+                              f"only {host_budget / 1024 ** 3:.1f} GB of the {host_avail / 1024 ** 3:.1f} GB host memory available.")
+
+        while True:
+            spoke_chunk = None
+            host_mem, device_mem = estimate_memory(name, recon, shapes)
+
+            # Without a GPU the device allocations come out of the host memory
+            budget = memory_fraction * device_avail if device_avail is not None else host_budget - host_mem
+            if device_mem > budget:
+                # Largest chunk that fits, the device memory is linear in the chunk size
+                _, fixed_mem = estimate_memory(name, recon, shapes, spoke_chunk=0)
+                _, chunk_mem = estimate_memory(name, recon, shapes, spoke_chunk=MIN_SPOKE_CHUNK)
+                per_spoke = (chunk_mem - fixed_mem) / MIN_SPOKE_CHUNK
+                spoke_chunk = int((budget - fixed_mem) // per_spoke) if per_spoke > 0 else 0
+                if spoke_chunk >= MIN_SPOKE_CHUNK:
+                    _, device_mem = estimate_memory(name, recon, shapes, spoke_chunk=spoke_chunk)
+
+            fits = host_mem <= host_budget and (spoke_chunk is None or spoke_chunk >= MIN_SPOKE_CHUNK)
+            if fits:
+                break
+
+            if not allow_downscale or min(recon.img_shape) <= MIN_IMG_SIZE:
+                raise MemoryError(f"{name} needs {host_mem / 1024 ** 3:.1f} GB host ({input_mem / 1024 ** 3:.1f} GB of input data) "
+                                  f"and {device_mem / 1024 ** 3:.1f} GB device memory, only {host_avail / 1024 ** 3:.1f} GB host memory available.")
+
+            img_shape = [max(MIN_IMG_SIZE, int(i * 0.75) // 2 * 2) for i in recon.img_shape]
+            logger.warning(f"{name} does not fit in memory, downscaling {recon.img_shape} to {img_shape}.")
+            recon.img_shape = img_shape
+
+        recon.spoke_chunk = spoke_chunk
+        runtime = estimate_runtime(name, recon, shapes, cost_model, device=device)
+        plan[name] = {"host_gb": host_mem / 1024 ** 3,
+                      "device_gb": device_mem / 1024 ** 3,
+                      "runtime_hours": runtime / 3600,
+                      "spoke_chunk": spoke_chunk,
+                      "img_shape": list(recon.img_shape)}
+        logger.info(f"Plan for {name}: {plan[name]}.")
+
+    return plan
+
+
+def calibrate_cost_model(cost_model_path, device=-1, img_sizes=(32, 48, 64), num_spokes=(2000, 8000), kernel_widths=(2.5, 4), num_readouts=64):
+    """
+    Fit the runtime model coefficients from adjoint NUFFT benchmarks on
+    random trajectories and store them in `cost_model_path`.
+    """
+    device = sp.Device(device)
+    device_type = "cpu" if device.id < 0 else "gpu"
+    logger.info(f"Calibrating the {device_type} cost model ...")
+
+    features, runtimes = [], []
+    with device:
+        xp = device.xp
+        for img_size in img_sizes:
+            img_shape = [img_size] * 3
+            grid_size = _get_oversamp_size(img_shape, 1.25)
+            for spokes in num_spokes:
+                coord = xp.random.uniform(-img_size / 2, img_size / 2, (spokes, num_readouts, 3)).astype(np.float32)
+                ksp = xp.ones((spokes, num_readouts), dtype=np.complex64)
+                for kernel_width in kernel_widths:
+                    # The first run warms up the FFT plans and kernels
+                    for _ in range(2):
+                        start_time = time.perf_counter()
+                        sp.nufft_adjoint(ksp, coord, oshape=img_shape, oversamp=1.25, width=kernel_width)
+                        if device.id >= 0:
+                            device.cpdevice.synchronize()
+                        runtime = time.perf_counter() - start_time
+
+                    features.append([spokes * num_readouts * kernel_width ** 3, grid_size * np.log2(grid_size)])
+                    runtimes.append(runtime)
+
+    coefs, _, _, _ = np.linalg.lstsq(np.array(features), np.array(runtimes), rcond=None)
+    coefs = np.maximum(coefs, 0)
+
+    cost_model = load_cost_model(cost_model_path)
+    cost_model[device_type] = {"gridding": float(coefs[0]),
+                               "fft": float(coefs[1]),
+                               "overhead": cost_model[device_type]["overhead"]}
+    with open(cost_model_path, "w") as f:
+        yaml.safe_dump(cost_model, f, sort_keys=True)
+
+    logger.info(f"Saved the calibrated cost model in {cost_model_path}.")
+
+    return cost_model
+
+
+def get_cost_model_file(config, config_path):
+    """Return the path of the calibrated cost model for a configuration."""
+    cost_model_path = config.get("planner", {}).get("cost_model")
+    if cost_model_path is None:
+        cost_model_path = os.path.join(os.path.dirname(os.path.abspath(config_path)), "cost_model.yaml")
+
+    return cost_model_path
+
+
+if __name__ == "__main__":
+    from utils.misc import load_config
+
+    parser = argparse.ArgumentParser(
+        description="Estimate the memory and runtime of the enabled reconstructions."
+        )
+    parser.add_argument("-i", "--encode_dir", type=str, help="Path to a processed encode directory.")
+    parser.add_argument("--config_path", type=str, help="Path to the YAML configuration file.")
+    parser.add_argument("--calibrate", action="store_true", help="Calibrate the runtime model on this machine.")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    from recon.build import build_recons
+
+    config = load_config(args.config_path)
+    device = sp.Device(0) if config["device"]["gpu"] else -1
+    cost_model_path = get_cost_model_file(config, args.config_path)
+
+    if args.calibrate:
+        calibrate_cost_model(cost_model_path, device=device)
+
+    if args.encode_dir is not None:
+        plan = plan_recons(build_recons(config, device),
+                           get_data_shapes(args.encode_dir),
+                           cost_model=load_cost_model(cost_model_path),
+                           device=device,
+                           memory_fraction=config["planner"]["memory_fraction"],
+                           allow_downscale=config["planner"]["allow_downscale"])
+        for name, entry in plan.items():
+            print(f"{name}: {entry['host_gb']:.1f} GB host, {entry['device_gb']:.1f} GB device, "
+                  f"{entry['runtime_hours']:.2f} hours, spoke_chunk={entry['spoke_chunk']}, img_shape={entry['img_shape']}")
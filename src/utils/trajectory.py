@@ -0,0 +1,277 @@
+import logging
+import numpy as np
+import sigpy as sp
+
+# Get the logger
+logger = logging.getLogger(__name__)
+
+
+def _normalize_key(key, ndim):
+    """
+    Expand an index into one entry per axis. Integer indices are turned
+    into length one slices and their axes returned, so that they can be
+    squeezed from the generated block.
+    """
+    if not isinstance(key, tuple):
+        key = (key, )
+
+    if any(k is Ellipsis for k in key):
+        i = key.index(Ellipsis)
+        key = key[:i] + (slice(None), ) * (ndim - len(key) + 1) + key[i + 1:]
+    key = key + (slice(None), ) * (ndim - len(key))
+
+    squeeze = []
+    normalized = []
+    for axis, k in enumerate(key):
+        if isinstance(k, (int, np.integer)):
+            k = slice(k, k + 1 if k != -1 else None)
+            squeeze.append(axis)
+        normalized.append(k)
+
+    return normalized, tuple(squeeze)
+
+
+class RadialTrajectory:
+    """
+    Compact representation of radial/UTE k-space coordinates.
+
+    Every spoke is the same radial readout profile along its own direction,
+    i.e. coord[s, r] = radial_profile[r] * directions[s] * scale. Indexing
+    the object generates the dense coordinates of the requested block, so
+    it can be used in place of the (num_traj, num_readouts, num_dim) array
+    wherever the code works on blocks of spokes.
+
+    Parameters:
+    -----------
+        directions : np.ndarray
+            Unit direction of every spoke of shape (num_traj, num_dim).
+
+        radial_profile : np.ndarray
+            Signed distance from the k-space center of every readout of shape (num_readouts, ).
+
+        scale : np.ndarray
+            Per-axis scaling of the coordinates (e.g. from auto_fov) of shape (num_dim, ).
+    """
+
+    def __init__(self, directions, radial_profile, scale=None):
+        self.directions = directions
+        self.radial_profile = radial_profile
+        self.scale = np.ones(directions.shape[1], dtype=directions.dtype) if scale is None else np.asarray(scale)
+
+    @property
+    def shape(self):
+        return (self.directions.shape[0], self.radial_profile.shape[0], self.directions.shape[1])
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def dtype(self):
+        return self.directions.dtype
+
+    @property
+    def nbytes(self):
+        return self.directions.nbytes + self.radial_profile.nbytes + self.scale.nbytes
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        (spokes, readouts, dims), squeeze = _normalize_key(key, 3)
+        directions = (self.directions[spokes] * self.scale)[:, dims]
+        block = directions[:, None, :] * self.radial_profile[readouts][None, :, None]
+        block = block.astype(self.dtype, copy=False)
+
+        return block.squeeze(axis=squeeze) if squeeze else block
+
+    def __array__(self, dtype=None, copy=None):
+        block = self.to_dense()
+        return block if dtype is None else block.astype(dtype)
+
+    def __imul__(self, scale):
+        self.scale = self.scale * np.asarray(scale)
+        return self
+
+    def to_dense(self):
+        """Return the dense (num_traj, num_readouts, num_dim) coordinates."""
+        return self[:]
+
+    def select(self, idx):
+        """Return the trajectory of the spokes selected by `idx`."""
+        return RadialTrajectory(self.directions[idx], self.radial_profile, self.scale)
+
+    def estimate_shape(self):
+        """Same as sigpy.estimate_shape, computed from the extreme directions and readouts."""
+        shape = []
+        profile = [self.radial_profile.min(), self.radial_profile.max()]
+        for i in range(self.shape[-1]):
+            direction = self.directions[:, i] * self.scale[i]
+            values = [p * d for p in profile for d in (direction.min(), direction.max())]
+            shape.append(int(max(values) - min(values)))
+
+        return shape
+
+    @classmethod
+    def from_dense(cls, coord, rtol=1e-3, block_size=10000):
+        """
+        Fit the compact representation to dense coordinates.
+
+        Returns:
+        --------
+            traj : RadialTrajectory or None
+                The compact trajectory, None if the coordinates differ from
+                it by more than `rtol` of the maximum k-space radius.
+        """
+        # Direction of each spoke from the outermost readout
+        radius = np.linalg.norm(coord[: min(len(coord), block_size)], axis=-1).mean(axis=0)
+        outer = int(np.argmax(radius))
+        directions = coord[:, outer, :] / np.linalg.norm(coord[:, outer, :], axis=-1, keepdims=True)
+        directions = np.nan_to_num(directions).astype(coord.dtype)
+
+        # Signed readout profile, averaged over the spokes
+        radial_profile = np.einsum("srd,sd->r", coord, directions) / len(coord)
+        traj = cls(directions, radial_profile.astype(coord.dtype))
+
+        max_radius = np.abs(radial_profile).max()
+        for start in range(0, len(coord), block_size):
+            error = np.abs(coord[start:start + block_size] - traj[start:start + block_size]).max()
+            if error > rtol * max_radius:
+                logger.info(f"Trajectory is not radial (error {error / max_radius:.2e}), keeping dense coordinates.")
+                return None
+
+        return traj
+
+
+class RadialDcf:
+    """
+    Compact density compensation factors of a radial trajectory, i.e.
+    dcf[s, r] = spoke_weights[s] * dcf_profile[r]. The spoke weights hold
+    the gating weights applied to the spokes.
+
+    Parameters:
+    -----------
+        dcf_profile : np.ndarray
+            DCF of every readout of shape (num_readouts, ).
+
+        spoke_weights : np.ndarray
+            Weight of every spoke of shape (num_traj, ).
+    """
+
+    def __init__(self, dcf_profile, spoke_weights):
+        self.dcf_profile = dcf_profile
+        self.spoke_weights = spoke_weights
+
+    @property
+    def shape(self):
+        return (self.spoke_weights.shape[0], self.dcf_profile.shape[0])
+
+    @property
+    def ndim(self):
+        return 2
+
+    @property
+    def dtype(self):
+        return np.result_type(self.dcf_profile, self.spoke_weights)
+
+    @property
+    def nbytes(self):
+        return self.dcf_profile.nbytes + self.spoke_weights.nbytes
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        (spokes, readouts), squeeze = _normalize_key(key, 2)
+        block = self.spoke_weights[spokes][:, None] * self.dcf_profile[readouts][None, :]
+
+        return block.squeeze(axis=squeeze) if squeeze else block
+
+    def __array__(self, dtype=None, copy=None):
+        block = self.to_dense()
+        return block if dtype is None else block.astype(dtype)
+
+    def to_dense(self):
+        """Return the dense (num_traj, num_readouts) DCF."""
+        return self[:]
+
+    def select(self, idx):
+        """Return the DCF of the spokes selected by `idx`."""
+        return RadialDcf(self.dcf_profile, self.spoke_weights[idx])
+
+    @classmethod
+    def from_dense(cls, dcf, rtol=1e-3):
+        """
+        Fit the compact representation to a dense DCF.
+
+        Returns:
+        --------
+            dcf : RadialDcf or None
+                The compact DCF, None if the DCF differs from it by more
+                than `rtol` of its maximum.
+        """
+        dcf_profile = dcf.mean(axis=0)
+        error = np.abs(dcf - dcf_profile).max()
+        if error > rtol * np.abs(dcf_profile).max():
+            logger.info(f"DCF is not the same on every spoke, keeping the dense DCF.")
+            return None
+
+        return cls(dcf_profile, np.ones(dcf.shape[0], dtype=dcf.dtype))
+
+
+def select_spokes(x, idx):
+    """Select spokes of a dense array or of a compact trajectory/DCF."""
+    if isinstance(x, (RadialTrajectory, RadialDcf)):
+        return x.select(idx)
+
+    return x[idx]
+
+
+def weight_spokes(dcf, weights):
+    """Multiply the DCF of every spoke by a weight of shape (num_traj, )."""
+    if isinstance(dcf, RadialDcf):
+        return RadialDcf(dcf.dcf_profile, dcf.spoke_weights * weights)
+
+    return dcf * weights[:, None]
+
+
+def estimate_shape(coord):
+    """sigpy.estimate_shape for dense or compact coordinates."""
+    if isinstance(coord, RadialTrajectory):
+        return coord.estimate_shape()
+
+    return sp.estimate_shape(coord)
+
+
+def compact_arrays(coord=None, dcf=None):
+    """
+    Return the arrays describing a compact trajectory and/or DCF. Dense
+    arrays are ignored.
+    """
+    arrays = {}
+    if isinstance(coord, RadialTrajectory):
+        arrays.update(directions=coord.directions, radial_profile=coord.radial_profile, scale=coord.scale)
+    if isinstance(dcf, RadialDcf):
+        arrays.update(dcf_profile=dcf.dcf_profile, spoke_weights=dcf.spoke_weights)
+
+    return arrays
+
+
+def save_compact(path, coord=None, dcf=None):
+    """Save a compact trajectory and/or DCF in a single .npz file."""
+    np.savez(path, **compact_arrays(coord=coord, dcf=dcf))
+
+
+def load_compact(path):
+    """
+    Load a compact trajectory and DCF saved by `save_compact`. Parts that
+    were not saved are returned as None.
+    """
+    coord, dcf = None, None
+    with np.load(path) as f:
+        if "directions" in f:
+            coord = RadialTrajectory(f["directions"], f["radial_profile"], f["scale"])
+        if "dcf_profile" in f:
+            dcf = RadialDcf(f["dcf_profile"], f["spoke_weights"])
+
+    return coord, dcf
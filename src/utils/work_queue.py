@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import socket
+import hashlib
+import logging
+
+# Get the logger
+logger = logging.getLogger(__name__)
+
+# Job states
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+class WorkQueue:
+    """
+    File-backed work queue shared by several processes.
+
+    Every job is a `<job_id>.json` file in `queue_dir`. A process owns a job
+    while it holds `<job_id>.lock`, which is created atomically and records
+    the owner's host and pid, so that locks left behind by a killed worker
+    can be detected and reclaimed.
+    """
+
+    def __init__(self, queue_dir):
+        self.queue_dir = queue_dir
+        os.makedirs(self.queue_dir, exist_ok=True)
+
+
+    def __job_path(self, job_id):
+        return os.path.join(self.queue_dir, f"{job_id}.json")
+
+
+    def __lock_path(self, job_id):
+        return os.path.join(self.queue_dir, f"{job_id}.lock")
+
+
+    def __read(self, job_id):
+        with open(self.__job_path(job_id), "r") as f:
+            return json.load(f)
+
+
+    def __write(self, job):
+        path = self.__job_path(job["id"])
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+    def __acquire(self, job_id):
+        lock_path = self.__lock_path(job_id)
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+
+        with os.fdopen(fd, "w") as f:
+            json.dump({"host": socket.gethostname(), "pid": os.getpid()}, f)
+
+        return True
+
+
+    def __release(self, job_id):
+        try:
+            os.remove(self.__lock_path(job_id))
+        except FileNotFoundError:
+            pass
+
+
+    def __lock_is_stale(self, job_id):
+        try:
+            with open(self.__lock_path(job_id), "r") as f:
+                owner = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            # Missing or half-written lock, let the next claim retry
+            return False
+
+        # Only locks of this host can be checked
+        return owner["host"] == socket.gethostname() and not _pid_alive(owner["pid"])
+
+
+    def job_ids(self):
+        return sorted(f[:-len(".json")] for f in os.listdir(self.queue_dir) if f.endswith(".json"))
+
+
+    def jobs(self):
+        return [self.__read(job_id) for job_id in self.job_ids()]
+
+
+    def add(self, raw_path, requeue=False, **fields):
+        """
+        Add an exam to the queue. Exams that are already queued keep their
+        state, so finished exams are not run again, unless `requeue` is set.
+
+        Parameters:
+        -----------
+            raw_path : str
+                Path of the exam directory.
+
+            requeue : bool
+                Run finished or failed exams again.
+
+            fields : dict
+                Extra job fields, e.g. the configuration path.
+
+        Returns:
+        --------
+            job_id : str
+                Identifier of the job.
+        """
+        raw_path = os.path.abspath(raw_path)
+        digest = hashlib.sha1(raw_path.encode()).hexdigest()[:12]
+        job_id = f"{os.path.basename(raw_path.rstrip(os.sep))}_{digest}"
+
+        job = {"id": job_id,
+               "raw_path": raw_path,
+               "status": PENDING,
+               "attempts": 0,
+               "elapsed": None,
+               "error": None,
+               **fields}
+
+        if os.path.exists(self.__job_path(job_id)):
+            status = self.__read(job_id)["status"]
+            # The lock keeps a worker from claiming a failed job while it is reset
+            if not requeue or status not in (DONE, FAILED) or not self.__acquire(job_id):
+                logger.info(f"{raw_path} already queued as {job_id} ({status}).")
+                return job_id
+            self.__write(job)
+            self.__release(job_id)
+
+            return job_id
+
+        self.__write(job)
+
+        return job_id
+
+
+    def get(self, job_id):
+        return self.__read(job_id)
+
+
+    def reclaim_stale(self):
+        """Mark the running jobs of dead workers as failed and remove their locks."""
+        for job_id in self.job_ids():
+            if os.path.exists(self.__lock_path(job_id)) and self.__lock_is_stale(job_id):
+                logger.warning(f"Reclaiming stale lock of {job_id}.")
+                job = self.__read(job_id)
+                if job["status"] == RUNNING:
+                    job["status"] = FAILED
+                    job["error"] = "Worker died while running the job."
+                    self.__write(job)
+                self.__release(job_id)
+
+
+    def has_work(self, max_retries=2):
+        """Check whether some job is pending or can still be retried."""
+        return any(job["status"] == PENDING or (job["status"] == FAILED and job["attempts"] <= max_retries)
+                   for job in self.jobs())
+
+
+    def claim(self, max_retries=2):
+        """
+        Claim the next pending job, or a failed one with retries left.
+
+        Returns:
+        --------
+            job : dict or None
+                The claimed job, None if there is nothing left to run.
+        """
+        self.reclaim_stale()
+
+        for job_id in self.job_ids():
+            job = self.__read(job_id)
+            if not (job["status"] == PENDING or (job["status"] == FAILED and job["attempts"] <= max_retries)):
+                continue
+
+            if not self.__acquire(job_id):
+                continue
+
+            # Another worker may have finished the job between the read and the lock
+            job = self.__read(job_id)
+            if not (job["status"] == PENDING or (job["status"] == FAILED and job["attempts"] <= max_retries)):
+                self.__release(job_id)
+                continue
+
+            job["status"] = RUNNING
+            job["attempts"] += 1
+            job["started"] = time.time()
+            self.__write(job)
+
+            return job
+
+        return None
+
+
+    def complete(self, job, elapsed):
+        job["status"] = DONE
+        job["elapsed"] = elapsed
+        job["error"] = None
+        self.__write(job)
+        self.__release(job["id"])
+
+
+    def fail(self, job, elapsed, error):
+        job["status"] = FAILED
+        job["elapsed"] = elapsed
+        job["error"] = error
+        self.__write(job)
+        self.__release(job["id"])
+
+
+    def write_summary(self, filename="summary.tsv"):
+        """Write a tab separated table with the state and timing of every job."""
+        summary_path = os.path.join(self.queue_dir, filename)
+        with open(summary_path, "w") as f:
+            f.write("job_id\traw_path\tstatus\tattempts\telapsed_hours\terror\n")
+            for job in self.jobs():
+                elapsed = "" if job["elapsed"] is None else f"{job['elapsed'] / 3600:.2f}"
+                error = (job["error"] or "").replace("\t", " ").replace("\n", " ")
+                f.write(f"{job['id']}\t{job['raw_path']}\t{job['status']}\t{job['attempts']}\t{elapsed}\t{error}\n")
+
+        logger.info(f"Saved the batch summary at {summary_path}.")
+
+        return summary_path
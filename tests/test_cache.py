@@ -0,0 +1,92 @@
+import os
+import pytest
+import numpy as np
+
+import utils.cache as cache_module
+from utils.cache import ResultCache, _get_code_modules, code_version, fingerprint_arrays, make_cache_key, rewriting_output
+from no_gating.no_gating import NoGating
+from hard_gating.hard_gating import HardGating
+
+
+def write_output(path, value):
+    with open(path, "w") as f:
+        f.write(value)
+
+
+def test_key_follows_params():
+    fingerprint = fingerprint_arrays({"ksp": np.arange(10)})
+    key = make_cache_key(fingerprint, "no_gating", NoGating(img_shape=[64, 64, 64]))
+
+    # The device and the chunking do not change the output
+    assert make_cache_key(fingerprint, "no_gating", NoGating(img_shape=[64, 64, 64], spoke_chunk=1000)) == key
+    assert make_cache_key(fingerprint, "no_gating", NoGating(img_shape=[32, 32, 32])) != key
+    assert make_cache_key(fingerprint_arrays({"ksp": np.arange(11)}), "no_gating", NoGating(img_shape=[64, 64, 64])) != key
+
+
+def test_skip_and_recompute(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    output_path = str(tmp_path / "no_gating.nii.gz")
+    key_a = make_cache_key("data", "no_gating", NoGating(img_shape=[64, 64, 64]))
+    key_b = make_cache_key("data", "no_gating", NoGating(img_shape=[32, 32, 32]))
+
+    assert not cache.is_current(output_path, key_a)
+    with rewriting_output(output_path, key_a, cache=cache):
+        write_output(output_path, "A")
+
+    assert cache.is_current(output_path, key_a)
+    assert not cache.is_current(output_path, key_b)
+
+
+def test_interrupted_rewrite_drops_key(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    output_path = str(tmp_path / "no_gating.nii.gz")
+    with rewriting_output(output_path, "key_a", cache=cache):
+        write_output(output_path, "A")
+
+    # A run with other parameters crashes after overwriting the output
+    with pytest.raises(RuntimeError):
+        with rewriting_output(output_path, "key_b", cache=cache):
+            write_output(output_path, "B")
+            raise RuntimeError("crash")
+
+    assert not cache.is_current(output_path, "key_a")
+    assert not cache.is_current(output_path, "key_b")
+
+
+def test_rewrite_without_cache_drops_key(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    output_path = str(tmp_path / "no_gating.nii.gz")
+    with rewriting_output(output_path, "key_a", cache=cache):
+        write_output(output_path, "A")
+
+    with rewriting_output(output_path):
+        write_output(output_path, "B")
+
+    assert not os.path.exists(output_path + ".key")
+    assert not cache.is_current(output_path, "key_a")
+
+
+def test_code_version_covers_helpers(monkeypatch):
+    # The gating builds its trajectory and DCF through utils.trajectory
+    names = [module.__name__ for module in _get_code_modules(HardGating())]
+    assert names == ["hard_gating.hard_gating", "recon.base", "utils.trajectory"]
+
+    version = code_version(HardGating())
+    assert code_version(NoGating()) != version
+    monkeypatch.setattr(cache_module.sp, "__version__", "0.0.0")
+    assert code_version(HardGating()) != version
+
+
+def test_store_load_evict(tmp_path):
+    volume = np.ones((16, 16, 16))
+    cache = ResultCache(str(tmp_path / "cache"), max_size_gb=1.5 * volume.nbytes / 1024 ** 3)
+
+    cache.store("a", volume)
+    np.testing.assert_array_equal(cache.load("a"), volume)
+    assert cache.load("b") is None
+
+    # Only one volume fits, the least recently used one is evicted
+    os.utime(os.path.join(cache.cache_dir, "a.npy"), (0, 0))
+    cache.store("b", 2 * volume)
+    assert cache.load("a") is None
+    np.testing.assert_array_equal(cache.load("b"), 2 * volume)
@@ -0,0 +1,66 @@
+import time
+import weakref
+import threading
+import numpy as np
+
+import utils.convert_h5_to_npy as convert_h5_to_npy
+from utils.convert_h5_to_npy import prefetch_ute
+
+
+class FakeArray:
+    """Stands in for the arrays of an encode, tracked by a weak reference."""
+
+    def __init__(self):
+        self.data = np.zeros(16)
+
+
+def fake_encodes(live, num_encodes):
+    def iter_ute(h5_path, **kwargs):
+        for encode in range(num_encodes):
+            ksp = FakeArray()
+            live.add(ksp)
+            yield encode, (ksp, )
+
+    return iter_ute
+
+
+def test_prefetch_bounds_memory(tmp_path, monkeypatch):
+    live = weakref.WeakSet()
+    saved = []
+
+    def slow_save(encode_dir, *data):
+        # Saving is slower than the reconstruction, e.g. on network storage
+        time.sleep(0.05)
+        saved.append(encode_dir)
+
+    monkeypatch.setattr(convert_h5_to_npy, "iter_ute", fake_encodes(live, 6))
+    monkeypatch.setattr(convert_h5_to_npy, "save_encode", slow_save)
+
+    peak = 0
+    names = []
+    for encode_dir, data in prefetch_ute("MRI_Raw.h5", output_dir=str(tmp_path), prefetch=1):
+        names.append(encode_dir)
+        data = None
+        time.sleep(0.01)
+        peak = max(peak, len(live))
+
+    assert names == [f"encode_{i}" for i in range(6)]
+    assert len(saved) == 6
+    # The encode being saved, the buffered one and the one being converted
+    assert peak <= 3
+
+
+def test_prefetch_early_stop(monkeypatch):
+    live = weakref.WeakSet()
+    monkeypatch.setattr(convert_h5_to_npy, "iter_ute", fake_encodes(live, 10))
+    num_threads = threading.active_count()
+
+    encodes = prefetch_ute("MRI_Raw.h5", prefetch=1)
+    assert next(encodes)[0] == "encode_0"
+    encodes.close()
+
+    # The converter stops instead of blocking on the full buffer
+    deadline = time.time() + 5
+    while threading.active_count() > num_threads and time.time() < deadline:
+        time.sleep(0.05)
+    assert threading.active_count() == num_threads
@@ -0,0 +1,38 @@
+import os
+import json
+import time
+import pytest
+
+from daemon import HEARTBEAT_FILE, Heartbeat, status, submit
+
+
+def test_heartbeat_during_job(tmp_path, capsys):
+    heartbeat = Heartbeat(str(tmp_path / HEARTBEAT_FILE), interval=0.05)
+    heartbeat.start()
+    try:
+        heartbeat.set_job("exam_0")
+        with open(heartbeat.path, "r") as f:
+            first = json.load(f)["time"]
+
+        # The file stays fresh while the job runs
+        time.sleep(0.3)
+        with open(heartbeat.path, "r") as f:
+            assert json.load(f)["time"] > first
+
+        status(str(tmp_path), max_heartbeat_age=0.2)
+        assert "running job exam_0" in capsys.readouterr().out
+
+        heartbeat.set_job(None)
+        status(str(tmp_path), max_heartbeat_age=0.2)
+        assert "idle" in capsys.readouterr().out
+    finally:
+        heartbeat.stop()
+
+    assert not os.path.exists(heartbeat.path)
+    status(str(tmp_path))
+    assert "not running" in capsys.readouterr().out
+
+
+def test_submit_needs_config(tmp_path):
+    with pytest.raises(ValueError):
+        submit(str(tmp_path / "spool"), str(tmp_path / "exam"), str(tmp_path / "missing.yaml"))
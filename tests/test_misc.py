@@ -0,0 +1,42 @@
+import os
+import json
+import pytest
+import numpy as np
+
+from utils.misc import minmax_normalize, remove_multiscale_volume, save_multiscale_volume
+
+
+def test_multiscale_round_trip(tmp_path):
+    zarr = pytest.importorskip("zarr")
+    volume = np.random.default_rng(0).uniform(0, 1, (40, 24, 16))
+    save_multiscale_volume(volume, filename="recon.zarr", save_dir=str(tmp_path), chunk_size=8)
+    output_path = os.path.join(str(tmp_path), "recon.zarr")
+
+    # OME-Zarr 0.4 needs a Zarr v2 store with the multiscales at the top level
+    assert os.path.exists(os.path.join(output_path, ".zgroup"))
+    assert not os.path.exists(output_path + ".tmp")
+    with open(os.path.join(output_path, ".zattrs"), "r") as f:
+        multiscales = json.load(f)["multiscales"][0]
+    assert multiscales["version"] == "0.4"
+    assert [axis["name"] for axis in multiscales["axes"]] == ["z", "y", "x"]
+
+    group = zarr.open_group(output_path, mode="r")
+    levels = [np.asarray(group[dataset["path"]]) for dataset in multiscales["datasets"]]
+    # Halved until a level fits in one chunk
+    assert [level.shape for level in levels] == [(16, 24, 40), (8, 12, 20), (4, 6, 10), (2, 3, 5)]
+    expected = np.round(minmax_normalize(volume, 0, 255)).astype(np.uint8)
+    np.testing.assert_array_equal(levels[0], np.transpose(expected))
+
+
+def test_multiscale_frames_first(tmp_path):
+    zarr = pytest.importorskip("zarr")
+    volume = np.random.default_rng(0).uniform(0, 1, (16, 12, 8, 3))
+    save_multiscale_volume(volume, filename="recon.zarr", save_dir=str(tmp_path), chunk_size=16)
+    save_multiscale_volume(volume, filename="recon.zarr", save_dir=str(tmp_path), chunk_size=16)
+
+    group = zarr.open_group(os.path.join(str(tmp_path), "recon.zarr"), mode="r")
+    assert [axis["name"] for axis in group.attrs["multiscales"][0]["axes"]] == ["t", "z", "y", "x"]
+    assert group["0"].shape == (3, 8, 12, 16)
+
+    remove_multiscale_volume("recon.zarr", str(tmp_path))
+    assert not os.path.exists(os.path.join(str(tmp_path), "recon.zarr"))
@@ -0,0 +1,46 @@
+import logging
+import pytest
+import numpy as np
+
+import utils.planner as planner
+from utils.planner import estimate_input_memory, estimate_memory, plan_recons
+from no_gating.no_gating import NoGating
+
+
+def shapes_of(num_coils, num_spokes, num_readouts):
+    return {"ksp": ((num_coils, num_spokes, num_readouts), np.dtype(np.complex64)),
+            "coord": ((num_spokes, num_readouts, 3), np.dtype(np.float32)),
+            "dcf": ((num_spokes, num_readouts), np.dtype(np.float32)),
+            "resp": ((num_spokes, ), np.dtype(np.float64))}
+
+
+def set_memory(monkeypatch, host_gb):
+    monkeypatch.setattr(planner, "get_available_memory", lambda device=-1: (int(host_gb * 1024 ** 3), None))
+
+
+def test_refuse_large_input(monkeypatch, caplog):
+    # About 65 GB of k-space, far beyond the host memory
+    shapes = shapes_of(32, 1000000, 256)
+    set_memory(monkeypatch, 16)
+    recon = NoGating(img_shape=[256, 256, 256])
+
+    with caplog.at_level(logging.WARNING), pytest.raises(MemoryError, match="input data alone"):
+        plan_recons({"no_gating": recon}, shapes, allow_downscale=True)
+
+    assert recon.img_shape == [256, 256, 256]
+    assert "downscaling" not in caplog.text
+
+
+def test_downscale_large_image(monkeypatch):
+    shapes = shapes_of(4, 10000, 64)
+    recon = NoGating(img_shape=[512, 512, 512])
+    host_mem, device_mem = estimate_memory("no_gating", recon, shapes)
+    assert estimate_input_memory("no_gating", recon, shapes) < host_mem / 10
+    set_memory(monkeypatch, (host_mem + device_mem) / 4 / 1024 ** 3)
+
+    with pytest.raises(MemoryError):
+        plan_recons({"no_gating": NoGating(img_shape=[512, 512, 512])}, shapes)
+
+    plan = plan_recons({"no_gating": recon}, shapes, allow_downscale=True)
+    assert max(plan["no_gating"]["img_shape"]) < 512
+    assert recon.img_shape == plan["no_gating"]["img_shape"]
@@ -0,0 +1,69 @@
+import pytest
+import numpy as np
+import sigpy as sp
+
+from no_gating.no_gating import NoGating
+from mocostorm.mocostorm import MoCoStorm
+from sliding_window.sliding_window import SlidingWindow
+
+
+def random_encode(num_coils=2, num_spokes=300, num_readouts=16, img_size=16, seed=0):
+    rng = np.random.default_rng(seed)
+    ksp = (rng.standard_normal((num_coils, num_spokes, num_readouts))
+           + 1j * rng.standard_normal((num_coils, num_spokes, num_readouts))).astype(np.complex64)
+    coord = rng.uniform(-img_size / 2, img_size / 2, (num_spokes, num_readouts, 3)).astype(np.float32)
+    dcf = rng.uniform(0, 1, (num_spokes, num_readouts)).astype(np.float32)
+
+    return ksp, coord, dcf
+
+
+def test_chunked_coil_adjoint():
+    ksp, coord, dcf = random_encode()
+    img_shape = [16, 16, 16]
+    expected = sp.nufft_adjoint(ksp[0] * dcf, coord, oshape=img_shape, oversamp=1.25, width=4)
+
+    for spoke_chunk in (None, 70):
+        recon = NoGating(img_shape=img_shape, oversamp=1.25, kernel_width=4, spoke_chunk=spoke_chunk)
+        img = recon._coil_adjoint(ksp[0], coord, dcf)
+        np.testing.assert_allclose(img, expected, rtol=1e-4, atol=1e-4 * np.abs(expected).max())
+
+
+def test_sliding_window_frames():
+    ksp, coord, dcf = random_encode()
+    img_shape = [16, 16, 16]
+    # A refresh every third frame exercises both the full and the incremental gridding
+    recon = SlidingWindow(img_shape=img_shape, window=100, stride=40, oversamp=1.25, kernel_width=4, refresh=3)
+    img = recon.run(ksp, coord, dcf)
+
+    num_frames = recon.get_num_frames(ksp.shape[1])
+    assert img.shape == (*img_shape[::-1], num_frames)
+    for frame in range(num_frames):
+        start, stop = frame * recon.stride, frame * recon.stride + recon.window
+        expected = sum(np.abs(sp.nufft_adjoint(ksp[coil, start:stop] * dcf[start:stop], coord[start:stop],
+                                               oshape=img_shape, oversamp=1.25, width=4)) ** 2
+                       for coil in range(ksp.shape[0])) ** 0.5
+        expected = np.transpose(expected, (2, 1, 0))
+        np.testing.assert_allclose(img[..., frame], expected, rtol=1e-3, atol=1e-4 * expected.max())
+
+
+def test_sliding_window_too_few_spokes():
+    ksp, coord, dcf = random_encode(num_spokes=50)
+    recon = SlidingWindow(img_shape=[16, 16, 16], window=100, stride=40)
+    with pytest.raises(ValueError):
+        recon.run(ksp, coord, dcf)
+
+
+def test_mocostorm_states_last():
+    ksp, coord, dcf = random_encode()
+    resp = np.sin(np.linspace(0, 20 * np.pi, ksp.shape[1]))
+    recon = MoCoStorm(img_shape=[16, 12, 8], num_states=4, rank=2, kernel_width=4)
+    img = recon.run(ksp, coord, dcf, resp)
+
+    # Same spatial order as the gated outputs, transposed like them
+    assert img.shape == (8, 12, 16, 4)
+
+
+@pytest.mark.parametrize("num_states, rank", [(1, 1), (4, 0), (4, 5)])
+def test_mocostorm_invalid_subspace(num_states, rank):
+    with pytest.raises(ValueError):
+        MoCoStorm(num_states=num_states, rank=rank)
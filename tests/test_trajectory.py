@@ -0,0 +1,107 @@
+import pytest
+import numpy as np
+
+from utils.trajectory import RadialTrajectory, RadialDcf, select_spokes, weight_spokes
+
+
+def radial_coord(num_spokes=50, num_readouts=12, seed=0):
+    rng = np.random.default_rng(seed)
+    directions = rng.standard_normal((num_spokes, 3))
+    directions /= np.linalg.norm(directions, axis=-1, keepdims=True)
+    radial_profile = np.linspace(0, 32, num_readouts)
+
+    return (directions[:, None, :] * radial_profile[None, :, None]).astype(np.float32)
+
+
+def radial_dcf(num_spokes=50, num_readouts=12):
+    dcf_profile = np.linspace(0, 1, num_readouts) ** 2
+
+    return np.tile(dcf_profile, (num_spokes, 1)).astype(np.float32)
+
+
+KEYS = [
+    3,
+    -1,
+    -7,
+    slice(5, 20),
+    (slice(None), 4),
+    (2, -1),
+    Ellipsis,
+    (Ellipsis, 1),
+    (7, Ellipsis),
+    np.arange(50) % 3 == 0,
+]
+
+
+def test_trajectory_round_trip():
+    coord = radial_coord()
+    traj = RadialTrajectory.from_dense(coord)
+
+    assert traj is not None
+    assert traj.shape == coord.shape
+    assert traj.dtype == coord.dtype
+    np.testing.assert_allclose(traj.to_dense(), coord, rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(np.asarray(traj), coord, rtol=1e-5, atol=1e-5)
+
+
+def test_trajectory_not_radial():
+    coord = radial_coord()
+    coord += np.random.default_rng(1).uniform(-1, 1, coord.shape).astype(coord.dtype)
+
+    assert RadialTrajectory.from_dense(coord) is None
+
+
+@pytest.mark.parametrize("key", KEYS)
+def test_trajectory_indexing(key):
+    coord = radial_coord()
+    traj = RadialTrajectory.from_dense(coord)
+
+    np.testing.assert_allclose(traj[key], coord[key], rtol=1e-5, atol=1e-5)
+
+
+def test_trajectory_scale_and_select():
+    coord = radial_coord()
+    traj = RadialTrajectory.from_dense(coord)
+    traj *= np.array([1.0, 0.5, 2.0])
+    coord = coord * np.array([1.0, 0.5, 2.0], dtype=coord.dtype)
+
+    np.testing.assert_allclose(traj.to_dense(), coord, rtol=1e-5, atol=1e-5)
+    mask = np.arange(50) % 4 == 1
+    np.testing.assert_allclose(select_spokes(traj, mask).to_dense(), coord[mask], rtol=1e-5, atol=1e-5)
+
+
+def test_dcf_round_trip():
+    dcf = radial_dcf()
+    compact = RadialDcf.from_dense(dcf)
+
+    assert compact is not None
+    assert compact.shape == dcf.shape
+    np.testing.assert_allclose(compact.to_dense(), dcf, rtol=1e-6)
+    np.testing.assert_allclose(np.asarray(compact), dcf, rtol=1e-6)
+
+
+def test_dcf_not_constant():
+    dcf = radial_dcf()
+    dcf[10] *= 2
+
+    assert RadialDcf.from_dense(dcf) is None
+
+
+@pytest.mark.parametrize("key", KEYS)
+def test_dcf_indexing(key):
+    dcf = radial_dcf()
+    compact = RadialDcf.from_dense(dcf)
+    if isinstance(key, tuple) and len(key) > 2:
+        pytest.skip("The DCF has two axes.")
+
+    np.testing.assert_allclose(compact[key], dcf[key], rtol=1e-6)
+
+
+def test_dcf_weight_and_select():
+    dcf = radial_dcf()
+    compact = RadialDcf.from_dense(dcf)
+    weights = np.linspace(0, 1, 50)
+    mask = weights > 0.5
+
+    np.testing.assert_allclose(weight_spokes(compact, weights).to_dense(), weight_spokes(dcf, weights), rtol=1e-6)
+    np.testing.assert_allclose(select_spokes(compact, mask).to_dense(), dcf[mask], rtol=1e-6)
@@ -0,0 +1,83 @@
+import os
+import json
+import socket
+import subprocess
+import sys
+
+from utils.work_queue import WorkQueue, RUNNING, DONE, FAILED
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_claim(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue"))
+    job_id = queue.add(str(tmp_path / "exam"))
+
+    job = queue.claim()
+    assert job["id"] == job_id
+    assert job["status"] == RUNNING
+    assert job["attempts"] == 1
+    # The job is locked while it runs
+    assert queue.claim() is None
+
+    queue.complete(job, 1.0)
+    assert queue.get(job_id)["status"] == DONE
+    assert queue.claim() is None
+    assert not queue.has_work()
+
+
+def test_add_keeps_state(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue"))
+    job_id = queue.add(str(tmp_path / "exam"))
+    queue.complete(queue.claim(), 1.0)
+
+    assert queue.add(str(tmp_path / "exam")) == job_id
+    assert queue.get(job_id)["status"] == DONE
+
+    queue.add(str(tmp_path / "exam"), requeue=True)
+    assert queue.claim()["id"] == job_id
+
+
+def test_retry(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue"))
+    job_id = queue.add(str(tmp_path / "exam"))
+
+    for attempt in range(1, 3):
+        job = queue.claim(max_retries=1)
+        assert job["attempts"] == attempt
+        queue.fail(job, 1.0, "error")
+
+    # Both attempts failed, no retries left
+    assert queue.get(job_id)["status"] == FAILED
+    assert queue.claim(max_retries=1) is None
+    assert not queue.has_work(max_retries=1)
+
+
+def test_reclaim_stale_lock(tmp_path):
+    queue_dir = str(tmp_path / "queue")
+    queue = WorkQueue(queue_dir)
+    job_id = queue.add(str(tmp_path / "exam"))
+    job = queue.claim()
+
+    # Hand the lock to a worker that died mid-job
+    with open(os.path.join(queue_dir, f"{job_id}.lock"), "w") as f:
+        json.dump({"host": socket.gethostname(), "pid": dead_pid()}, f)
+
+    job = queue.claim()
+    assert job["id"] == job_id
+    assert job["status"] == RUNNING
+    assert job["attempts"] == 2
+
+
+def test_live_lock_is_kept(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue"))
+    queue.add(str(tmp_path / "exam"))
+    job = queue.claim()
+
+    queue.reclaim_stale()
+    assert queue.get(job["id"])["status"] == RUNNING
+    assert queue.claim() is None